@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import math
+import time
+from collections import deque
+from datetime import datetime, timedelta
+import settings
+
+
+class AdmissionRejected(Exception):
+    """The wait queue is full. retry_after is a hint in seconds."""
+    def __init__(self, retry_after):
+        super().__init__(f"Server busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Place of one pipeline run in the admission controller (running or queued)."""
+    def __init__(self, on_queued=None):
+        self.granted = asyncio.get_running_loop().create_future()
+        self.on_queued = on_queued
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.started_at is not None
+
+
+class AdmissionController:
+    """
+    Caps the number of pipelines running at once. Runs beyond the limit wait
+    in a bounded FIFO queue and are told their position and estimated start;
+    runs beyond the queue bound are rejected with a retry-after hint.
+    Start estimates use a moving average of the observed run durations.
+    """
+    def __init__(self, max_concurrent=settings.MAX_CONCURRENT_PIPELINES,
+                 max_queued=settings.ADMISSION_QUEUE_SIZE,
+                 default_run_seconds=settings.ADMISSION_DEFAULT_RUN_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.average_run_seconds = default_run_seconds
+        self._running = []
+        self._waiting = deque()
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    @property
+    def queued(self):
+        return len(self._waiting)
+
+    def enter(self, on_queued=None):
+        """
+        Returns a Ticket whose `granted` future resolves when the run may start.
+        on_queued(position, queue_length, wait_seconds) is called every time
+        the queue position changes. Raises AdmissionRejected if the queue is full.
+        """
+        ticket = Ticket(on_queued)
+        if len(self._running) < self.max_concurrent and not self._waiting:
+            self._grant(ticket)
+        elif len(self._waiting) >= self.max_queued:
+            raise AdmissionRejected(self.retry_after())
+        else:
+            self._waiting.append(ticket)
+            self._notify_queue()
+        return ticket
+
+    def leave(self, ticket, completed=False):
+        """Frees the slot (or queue place) of ticket. Completed runs feed the duration average."""
+        if ticket.running:
+            self._running.remove(ticket)
+            if completed:
+                duration = time.monotonic() - ticket.started_at
+                self.average_run_seconds = 0.8 * self.average_run_seconds + 0.2 * duration
+            if self._waiting:
+                self._grant(self._waiting.popleft())
+        elif ticket in self._waiting:
+            self._waiting.remove(ticket)
+        else:
+            return
+        self._notify_queue()
+
+    def _grant(self, ticket):
+        ticket.started_at = time.monotonic()
+        self._running.append(ticket)
+        if not ticket.granted.done():
+            ticket.granted.set_result(None)
+
+    def _estimated_waits(self, count):
+        """Seconds before each of the next `count` queued runs can start."""
+        now = time.monotonic()
+        slots = [max(0.0, t.started_at + self.average_run_seconds - now) for t in self._running]
+        slots += [0.0] * (self.max_concurrent - len(slots))
+        heapq.heapify(slots)
+
+        waits = []
+        for _ in range(count):
+            start = heapq.heappop(slots)
+            waits.append(start)
+            heapq.heappush(slots, start + self.average_run_seconds)
+        return waits
+
+    def retry_after(self):
+        """Seconds until the head of the queue should start, freeing a queue place."""
+        waits = self._estimated_waits(1)
+        return max(1, math.ceil(waits[0]))
+
+    def _notify_queue(self):
+        waits = self._estimated_waits(len(self._waiting))
+        for position, (ticket, wait) in enumerate(zip(self._waiting, waits), start=1):
+            if ticket.on_queued is not None:
+                ticket.on_queued(position, len(self._waiting), wait)
+
+
+def queued_message(position, queue_length, wait_seconds):
+    """Websocket status message of a run waiting for a slot."""
+    return {
+        "status": "queued",
+        "position": position,
+        "queue_length": queue_length,
+        "estimated_wait_seconds": round(wait_seconds),
+        "estimated_start": (datetime.now() + timedelta(seconds=wait_seconds)).isoformat(timespec="seconds"),
+    }
@@ -0,0 +1,182 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+# Suppress TensorFlow INFO/WARNING logs
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+
+# Suppress generic warnings
+warnings.filterwarnings("ignore")
+
+
+def _timeit(fn, repeat):
+    """Mean duration of fn() in milliseconds (after one warm-up call)."""
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def bench_export(args):
+    """
+    Parity and latency of the exported TorchScript model against the
+    pytorch_forecasting predict path, on a real restaurant history.
+    """
+    import torch
+    import main
+    import dataset_manager
+    import model_export
+    import settings
+    import model_prediction_affluence as mpa
+
+    df_history = dataset_manager.manager.load_history_from_db(restaurant_id=args.restaurant_id)
+    model, _, _ = main.train_or_reuse_model(args.restaurant_id, df_history, args.epochs, on_progress=lambda msg: None)
+
+    data = mpa.prepare_training_data(df_history.copy())
+    data_no_kairo = data.copy()
+    data_no_kairo.loc[data_no_kairo["time_idx"] > data_no_kairo["time_idx"].max() - mpa.MAX_PREDICTION_LENGTH, "sip"] = 0.0
+    batch, _, _ = mpa.encode_scenarios(model, data, mpa.DEFAULT_SCENARIOS)
+
+    path = os.path.join(tempfile.mkdtemp(), "model.ts")
+    if model_export.export_model(model, batch, path) is None:
+        print("Export failed.")
+        return
+    predictor = model_export.CompiledPredictor(path)
+
+    # --- Parity ---
+    reference = model.predict(data, mode="raw").output.prediction[0].detach().cpu().numpy()
+    model.eval()
+    with torch.no_grad():
+        eager = model(batch)["prediction"].cpu().numpy()
+    compiled = predictor.predict(batch)
+
+    diff_eager = abs(eager[0] - reference).max()
+    diff_compiled = abs(compiled - eager).max()
+    tolerance = settings.EXPORT_PARITY_TOLERANCE
+    print("--- Parity (max abs difference) ---")
+    print(f"batched eager vs model.predict : {diff_eager:.2e}")
+    print(f"compiled vs batched eager      : {diff_compiled:.2e}")
+    print("PASS" if max(diff_eager, diff_compiled) < tolerance else "FAIL")
+
+    # --- Latency ---
+    def predict_path():
+        model.predict(data, mode="raw")
+        model.predict(data_no_kairo, mode="raw")
+
+    def eager_path():
+        with torch.no_grad():
+            model(batch)
+
+    print(f"--- Latency, 2 scenarios (mean of {args.repeat}) ---")
+    print(f"model.predict x2        : {_timeit(predict_path, args.repeat):8.1f} ms")
+    print(f"batched eager forward   : {_timeit(eager_path, args.repeat):8.1f} ms")
+    print(f"compiled (TorchScript)  : {_timeit(lambda: predictor.predict(batch), args.repeat):8.1f} ms")
+
+
+def bench_history(args):
+    """
+    History load time: full database read vs the incremental Parquet copy,
+    with no new day and with --new_days days to fetch, and the database
+    queries behind each of them.
+    """
+    import pandas as pd
+    import database_service
+    import history_cache
+
+    service = database_service.service
+    cache = history_cache.HistoryCache(tempfile.mkdtemp())
+
+    full = _timeit(lambda: service.load_history_from_db(args.restaurant_id), args.repeat)
+    cache.load(args.restaurant_id)
+    up_to_date = _timeit(lambda: cache.load(args.restaurant_id), args.repeat)
+
+    # Drop the last days of the local copy so each load fetches them again
+    df = cache.load(args.restaurant_id)
+    watermark = df["date"].max().date()
+    truncated = df[df["date"] <= df["date"].max() - pd.Timedelta(days=args.new_days)]
+    truncated_watermark = truncated["date"].max().date()
+    checksum = service.history_checksum(args.restaurant_id, truncated_watermark)
+
+    def incremental():
+        cache._write(args.restaurant_id, truncated, checksum)
+        cache.load(args.restaurant_id)
+
+    rewrite = _timeit(lambda: cache._write(args.restaurant_id, truncated, checksum), args.repeat)
+    with_new_days = _timeit(incremental, args.repeat) - rewrite
+
+    # Database side of the loads above
+    new_rows_query = _timeit(lambda: service.load_history_from_db(args.restaurant_id, since=watermark), args.repeat)
+    prefix_checksum = _timeit(lambda: service.history_checksum(args.restaurant_id, truncated_watermark), args.repeat)
+    added_checksum = _timeit(
+        lambda: service.history_checksum(args.restaurant_id, watermark, since=truncated_watermark), args.repeat
+    )
+
+    print(f"--- History load, restaurant {args.restaurant_id}, {len(df)} days (mean of {args.repeat}) ---")
+    print(f"full database read       : {full:8.1f} ms")
+    print(f"local copy, no new day   : {up_to_date:8.1f} ms")
+    print(f"local copy, {args.new_days:3d} new days : {with_new_days:8.1f} ms")
+    print("--- Database queries ---")
+    print(f"new rows (none)          : {new_rows_query:8.1f} ms  (every load)")
+    print(f"checksum of copied days  : {prefix_checksum:8.1f} ms  (loads with new days)")
+    print(f"checksum of new days     : {added_checksum:8.1f} ms  (loads with new days)")
+
+
+def bench_startup(args):
+    """
+    Import cost of the server and of the ML modules, each measured in a fresh
+    interpreter (so nothing is already cached in sys.modules).
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    snippet = (
+        "import time, importlib; started = time.perf_counter(); "
+        "importlib.import_module('{module}'); print(time.perf_counter() - started)"
+    )
+
+    print(f"--- Import time (best of {args.repeat}) ---")
+    for module in args.modules:
+        timings = []
+        for _ in range(args.repeat):
+            result = subprocess.run(
+                [sys.executable, "-c", snippet.format(module=module)],
+                cwd=base_dir, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                print(f"{module:28s} failed: {result.stderr.strip().splitlines()[-1]}")
+                break
+            timings.append(float(result.stdout.strip().splitlines()[-1]))
+        if timings:
+            print(f"{module:28s} {min(timings) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kairoscope benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Parity and latency of the exported model")
+    export_parser.add_argument("--restaurant_id", type=int, default=1, help="Restaurant whose history is used")
+    export_parser.add_argument("--epochs", type=int, default=30, help="Training epochs if no model is registered")
+    export_parser.add_argument("--repeat", type=int, default=20, help="Timed iterations")
+    export_parser.set_defaults(func=bench_export)
+
+    history_parser = subparsers.add_parser("history", help="Full vs incremental history load")
+    history_parser.add_argument("--restaurant_id", type=int, default=1, help="Restaurant whose history is loaded")
+    history_parser.add_argument("--new_days", type=int, default=7, help="Days fetched by the incremental load")
+    history_parser.add_argument("--repeat", type=int, default=10, help="Timed iterations")
+    history_parser.set_defaults(func=bench_history)
+
+    startup_parser = subparsers.add_parser("startup", help="Import cost of server.py and the ML stack")
+    startup_parser.add_argument("--modules", nargs="*", default=["server", "main", "model_prediction_affluence", "gemini_service"], help="Modules to import")
+    startup_parser.add_argument("--repeat", type=int, default=3, help="Runs per module")
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
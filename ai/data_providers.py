@@ -1,30 +1,62 @@
 import pandas as pd
-import requests
-from geopy.geocoders import Nominatim
 import settings
+import holiday_calendar
+import weather_forecast
+from geocoding import geocoder
+from http_cache import cache as http_cache
+
+# Open-Meteo's archive consolidates the last days with a delay
+ARCHIVE_DELAY_DAYS = 7
+
+# Per-source request timeouts (seconds)
+TIMEOUTS = {
+    "holidays": 10,
+    "school_vacations": 15,
+    "geocoding": 10,
+    "archive_weather": 30,
+    "weather_forecast": 15,
+}
+
+def _ttl_seconds(last_day, ttl_hours, delay_days=0):
+    """Answers about a period over for good never expire (None), the others after ttl_hours."""
+    if pd.Timestamp(last_day) < pd.Timestamp.now().normalize() - pd.Timedelta(days=delay_days):
+        return None
+    return ttl_hours * 3600
 
 # --- 1. Holidays (Jours Fériés) ---
-def get_jours_ferie_data(year=2025):
+def get_jours_ferie_data(date_start, date_end, cross_check=settings.HOLIDAYS_CROSS_CHECK):
     """
-    Returns a DataFrame indexed by date with holiday names.
+    Returns a DataFrame indexed by date with holiday names, for every year of
+    the range. Computed locally (see holiday_calendar); with cross_check the
+    nager.at calendar is fetched and any difference is reported.
     """
+    df_holidays = holiday_calendar.french_holidays(date_start, date_end)
+    if cross_check:
+        for year in range(pd.Timestamp(date_start).year, pd.Timestamp(date_end).year + 1):
+            cross_check_holidays(year)
+    return df_holidays
+
+def cross_check_holidays(year):
+    """Compares the computed holidays of year with nager.at's nationwide ones. True if they match."""
     api_url = f"https://date.nager.at/api/v3/PublicHolidays/{year}/FR"
 
     try:
-        df_holidays = pd.read_json(api_url)
-        if df_holidays.empty:
-            return pd.DataFrame()
-            
-        # Keep only relevant columns
-        df_holidays = df_holidays[['date', 'localName']]
-        df_holidays['date'] = pd.to_datetime(df_holidays['date'])
-        df_holidays = df_holidays.rename(columns={'localName': 'holiday_name'})
-        df_holidays = df_holidays.set_index('date')
-        df_holidays['is_holiday'] = 1
-        return df_holidays
+        data = http_cache.get_json(
+            "holidays", api_url,
+            ttl_seconds=_ttl_seconds(f"{year}-12-31", settings.HOLIDAYS_TTL_HOURS), timeout=TIMEOUTS["holidays"]
+        )
     except Exception as e:
-        print(f"[ERROR] Error fetching holidays: {e}")
-        return pd.DataFrame()
+        print(f"[WARNING] Holiday cross-check skipped for {year}: {e}")
+        return None
+
+    # Regional holidays (Alsace-Moselle) are not nationwide
+    remote = {(pd.Timestamp(h["date"]).date(), h["localName"]) for h in data if h.get("global", True)}
+    local = set(holiday_calendar.holidays_of_year(year))
+    if remote != local:
+        print(f"[WARNING] Holiday calendar {year} differs from nager.at: "
+              f"missing {sorted(remote - local)}, unexpected {sorted(local - remote)}")
+        return False
+    return True
 
 # --- 2. School Vacations (Vacances Scolaires) ---
 def get_vacances_scolaires_data(date_start, date_end, academie="Dijon"):
@@ -40,9 +72,10 @@ def get_vacances_scolaires_data(date_start, date_end, academie="Dijon"):
     }
 
     try:
-        response = requests.get(api_url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = http_cache.get_json(
+            "school_vacations", api_url, params,
+            ttl_seconds=_ttl_seconds(date_end, settings.SCHOOL_VACATIONS_TTL_HOURS), timeout=TIMEOUTS["school_vacations"]
+        )
 
         vacations = []
         if "results" in data:
@@ -69,9 +102,8 @@ def get_historical_weather(date_start, date_end, ville):
     '''
     Fetch historical weather data using Open-Meteo API.
     '''
-    geolocator = Nominatim(user_agent="meteo_app_kairoscope")
     try:
-        location = geolocator.geocode(ville, timeout=10)
+        location = geocoder.geocode(ville, timeout=TIMEOUTS["geocoding"])
     except Exception as e:
         print(f"[ERROR] Geocoding error: {e}")
         return pd.DataFrame()
@@ -80,11 +112,12 @@ def get_historical_weather(date_start, date_end, ville):
         print(f"[ERROR] Error fetching location for {ville}")
         return pd.DataFrame()
     
+    latitude, longitude = location
     api_url = "https://archive-api.open-meteo.com/v1/archive"
     
     params = {
-        "latitude": location.latitude,
-        "longitude": location.longitude,
+        "latitude": latitude,
+        "longitude": longitude,
         "start_date": date_start,
         "end_date": date_end,
         "daily": ["weather_code", "temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max"],
@@ -92,9 +125,11 @@ def get_historical_weather(date_start, date_end, ville):
     }
 
     try:
-        response = requests.get(api_url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = http_cache.get_json(
+            "archive_weather", api_url, params,
+            ttl_seconds=_ttl_seconds(date_end, settings.ARCHIVE_WEATHER_TTL_HOURS, ARCHIVE_DELAY_DAYS),
+            timeout=TIMEOUTS["archive_weather"]
+        )
         
         if "daily" not in data:
             return pd.DataFrame()
@@ -118,22 +153,12 @@ def get_historical_weather(date_start, date_end, ville):
         return pd.DataFrame()
 
 def get_weather_forecast(start_date, end_date, lat, lon):
-    """Récupère les données météo prévisionnelles via OpenMeteo pour l'intervalle."""
+    """Récupère les données météo prévisionnelles via OpenMeteo pour l'intervalle (partagées par cellule, voir weather_forecast)."""
     try:
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "timezone": "auto",
-            "daily": "weather_code,temperature_2m_max,temperature_2m_min",
-            "forecast_days": 16
-        }
-        
-        response = requests.get(url, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
+        daily = weather_forecast.store.get(lat, lon, timeout=TIMEOUTS["weather_forecast"])
+        if not daily:
+            return {}
         
-        daily = data.get("daily", {})
         times = daily.get("time", [])
         codes = daily.get("weather_code", [])
         temps_max = daily.get("temperature_2m_max", [])
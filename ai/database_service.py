@@ -1,8 +1,14 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.pool
 import pandas as pd
-from geopy.geocoders import Nominatim
 import sys
+import settings
+from geocoding import geocoder
+from metrics import metrics
 
 # Singleton implementation for DB Service
 class DatabaseService:
@@ -12,22 +18,153 @@ class DatabaseService:
         self.db_name = os.environ.get("DB_NAME", "emergency_db")
         self.db_user = os.environ.get("DB_USER", "admin")
         self.db_password = os.environ.get("DB_PASSWORD", "admin")
-        self._conn = None
+
+        # Connection pool, created on first use (one per process)
+        self.pool_min_size = settings.DB_POOL_MIN_SIZE
+        self.pool_max_size = settings.DB_POOL_MAX_SIZE
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # ThreadedConnectionPool fails instead of waiting when exhausted
+        self._slots = threading.BoundedSemaphore(self.pool_max_size)
+        self._last_used = {}
+        self._in_use = 0
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.pool_min_size,
+                    self.pool_max_size,
+                    host=self.db_host,
+                    port=self.db_port,
+                    dbname=self.db_name,
+                    user=self.db_user,
+                    password=self.db_password
+                )
+                # Connections opened by the constructor (pool_min_size) are fresh
+                now = time.monotonic()
+                for conn in self._pool._pool:
+                    self._last_used[id(conn)] = now
+            return self._pool
+
+    def _is_healthy(self, conn):
+        """Connections idle for a while are checked before being handed out."""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used[id(conn)] < settings.DB_POOL_HEALTH_CHECK_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
 
     def get_connection(self):
+        """
+        Borrows a connection from the pool (waits up to DB_POOL_TIMEOUT_SECONDS
+        when all are in use). Returns None if the database is unreachable.
+        Give it back with release_connection, or use `with service.connection()`.
+        """
+        if not self._slots.acquire(timeout=settings.DB_POOL_TIMEOUT_SECONDS):
+            print(f"Error connecting to database: no free connection after {settings.DB_POOL_TIMEOUT_SECONDS}s")
+            metrics.increment("db_pool_timeouts")
+            return None
+
         try:
-            conn = psycopg2.connect(
-                host=self.db_host,
-                port=self.db_port,
-                dbname=self.db_name,
-                user=self.db_user,
-                password=self.db_password
-            )
-            return conn
+            pool = self._get_pool()
+            conn = pool.getconn()
+            # A connection never seen before was just opened by getconn
+            self._last_used.setdefault(id(conn), time.monotonic())
+            if not self._is_healthy(conn):
+                # Dropped by the server (restart, idle timeout): replace it
+                metrics.increment("db_pool_reconnects")
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+                self._last_used.setdefault(id(conn), time.monotonic())
         except Exception as e:
+            self._slots.release()
             print(f"Error connecting to database: {e}")
             return None
 
+        metrics.increment("db_pool_checkouts")
+        self._update_gauges(+1)
+        return conn
+
+    def release_connection(self, conn):
+        """Returns a borrowed connection to the pool (closes it if it is broken)."""
+        broken = conn.closed
+        if not broken:
+            try:
+                # End the implicit transaction opened by the reads
+                conn.rollback()
+            except Exception:
+                broken = True
+
+        if broken:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+            self._update_gauges(-1)
+
+    @contextmanager
+    def connection(self):
+        """Pooled connection (None if the database is unreachable), released on exit."""
+        conn = self.get_connection()
+        try:
+            yield conn
+        finally:
+            if conn:
+                self.release_connection(conn)
+
+    def _update_gauges(self, delta):
+        with self._pool_lock:
+            self._in_use += delta
+            metrics.set_gauge("db_pool_in_use", self._in_use)
+            metrics.set_gauge("db_pool_max_size", self.pool_max_size)
+
+    def pool_stats(self):
+        """Pool usage, for monitoring."""
+        snapshot = metrics.snapshot()
+        return {
+            "in_use": snapshot["gauges"].get("db_pool_in_use", 0),
+            "max_size": self.pool_max_size,
+            "checkouts": snapshot["counters"].get("db_pool_checkouts", 0),
+            "reconnects": snapshot["counters"].get("db_pool_reconnects", 0),
+            "timeouts": snapshot["counters"].get("db_pool_timeouts", 0),
+        }
+
+    def close_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+    def list_restaurant_ids(self):
+        """
+        Returns the ids of every restaurant, in id order.
+        """
+        conn = self.get_connection()
+        if not conn:
+            return []
+
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM restaurant ORDER BY id")
+            return [row[0] for row in cur.fetchall()]
+        except Exception as e:
+            print(f"Error listing restaurants: {e}")
+            return []
+        finally:
+            self.release_connection(conn)
+
     def get_restaurant_config(self, restaurant_id):
         """
         Fetches restaurant details from DB and supplements missing fields with defaults/geocoding.
@@ -52,7 +189,6 @@ class DatabaseService:
                 print(f"Restaurant {restaurant_id} not found.")
                 return None
             
-            import settings
             config = {
                 "id": row[0],
                 "name": row[1],
@@ -68,28 +204,15 @@ class DatabaseService:
             config["urban_context"] = "MOYEN" # Default as column missing in DB
             config["academy"] = "Dijon" # Default as column missing in DB
             
-            # Geocoding for Lat/Lon
-            # We can try to geocode the city to get approx coords if needed
-            # Or use the specific variables if they were columns
-            geolocator = Nominatim(user_agent="kairoscope_app_v1")
+            # Geocoding for Lat/Lon (full address first, then city), cached on disk
             try:
-                # Try full address first
-                location = geolocator.geocode(config["full_address"], timeout=5)
-                if not location:
-                    # Fallback to city
-                    location = geolocator.geocode(config["city"], timeout=5)
-                
-                if location:
-                    config["latitude"] = location.latitude
-                    config["longitude"] = location.longitude
-                else:
-                    # Fallback defaults (Chalon)
-                    config["latitude"] = 46.7833
-                    config["longitude"] = 4.85
+                coordinates = geocoder.locate(config["full_address"], config["city"])
             except Exception as e:
                 print(f"Geocoding failed: {e}")
-                config["latitude"] = 46.7833
-                config["longitude"] = 4.85
+                coordinates = None
+
+            # Fallback defaults (Chalon)
+            config["latitude"], config["longitude"] = coordinates or (46.7833, 4.85)
                 
             return config
             
@@ -97,42 +220,120 @@ class DatabaseService:
             print(f"Error fetching restaurant config: {e}")
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
-    def load_history_from_db(self, restaurant_id):
+    def get_last_history_date(self, restaurant_id):
+        """
+        Returns the date of the most recent history row of the restaurant
+        (None if the restaurant has no history or the DB is unreachable).
+        """
+        conn = self.get_connection()
+        if not conn:
+            return None
+
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT MAX(date_historique) FROM historique_affluence WHERE restaurant_id = %s",
+                (restaurant_id,)
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            print(f"Error fetching last history date: {e}")
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def history_checksum(self, restaurant_id, until, since=None):
+        """
+        [day count, sum of per-day hashes] of the restaurant's history up to
+        `until` (included), or only of the days after `since`, computed in SQL
+        over the rows load_history_from_db returns: any added, removed or
+        edited day changes it, and only two numbers are transferred. Checksums
+        of consecutive ranges add up, so extending a
+        known one only reads the new days (see history_cache.combine_checksums).
+        Used by history_cache to detect rewritten history. None on error.
+        """
+        conn = self.get_connection()
+        if not conn:
+            return None
+
+        query = """
+            SELECT COUNT(*), COALESCE(SUM(('x' || substr(md5(h::text), 1, 15))::bit(60)::bigint), 0)
+            FROM (
+                SELECT DISTINCT ON (date_historique)
+                       date_historique, holiday_name, is_holiday, is_school_vacations, vacation_name,
+                       weather_code, tmax, tmin, prcp, wspd, day_of_week, is_weekend,
+                       affluence, occupancy_rate, is_full, restaurant_id
+                FROM historique_affluence
+                WHERE restaurant_id = %s AND date_historique < %s::date + 1
+        """
+        params = [restaurant_id, until]
+        if since is not None:
+            query += " AND date_historique > %s"
+            params.append(since)
+        query += " ORDER BY date_historique ASC, id DESC) h"
+
+        try:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            count, total = cur.fetchone()
+            return [int(count), int(total)]
+        except Exception as e:
+            print(f"Error computing history checksum: {e}")
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def load_history_from_db(self, restaurant_id, since=None, date_from=None, date_to=None):
         """
         Loads history data directly from the PostgreSQL database.
-        Returns a DataFrame formatted for the model.
+        Returns a DataFrame formatted for the model, one row per day.
+        since: only the rows strictly after that date (incremental reload).
+        date_from / date_to: optional inclusive date range (e.g. the encoder window).
         MOVED from dataset_manager.py
         """
-        print(f"--- Loading History from DB for Restaurant {restaurant_id} ---")
+        bounds = [f"after {since}" if since is not None else None,
+                  f"from {date_from}" if date_from is not None else None,
+                  f"to {date_to}" if date_to is not None else None]
+        bounds = ", ".join(b for b in bounds if b)
+        print(f"--- Loading History from DB for Restaurant {restaurant_id}{f' ({bounds})' if bounds else ''} ---")
         
         conn = self.get_connection()
         if not conn:
             sys.exit(1)
 
-        query = f"""
-            SELECT date_historique, holiday_name, is_holiday, is_school_vacations, vacation_name,
+        # DISTINCT ON keeps the last inserted row of each day (duplicates in DB);
+        # the (restaurant_id, date_historique) index serves both filter and order.
+        query = """
+            SELECT DISTINCT ON (date_historique)
+                   date_historique, holiday_name, is_holiday, is_school_vacations, vacation_name,
                    weather_code, tmax, tmin, prcp, wspd, day_of_week, is_weekend,
                    affluence,  occupancy_rate,  is_full, restaurant_id
             FROM historique_affluence
-            WHERE restaurant_id = {restaurant_id}
-            ORDER BY date_historique ASC
+            WHERE restaurant_id = %s
         """
+        params = [restaurant_id]
+        if since is not None:
+            query += " AND date_historique > %s"
+            params.append(since)
+        if date_from is not None:
+            query += " AND date_historique >= %s"
+            params.append(date_from)
+        if date_to is not None:
+            # Timestamps of the last day are included
+            query += " AND date_historique < %s::date + 1"
+            params.append(date_to)
+        query += " ORDER BY date_historique ASC, id DESC"
         
         try:
-            df = pd.read_sql_query(query, conn)
+            df = pd.read_sql_query(query, conn, params=params)
             
             # Post-processing to match expected format
             df['date'] = pd.to_datetime(df['date_historique'])
-            df = df.set_index('date')
             df.drop(columns=['date_historique'], inplace=True)
-            
-            # Ensure unique index (handle existing duplicates in DB)
-            df = df[~df.index.duplicated(keep='last')]
-            
-            # Reset index to return 'date' as a column
-            df.reset_index(inplace=True)
+            df = df[['date'] + [c for c in df.columns if c != 'date']]
             
             print(f"Loaded {len(df)} rows from database.")
             return df
@@ -141,7 +342,48 @@ class DatabaseService:
             print(f"Error reading history: {e}")
             return pd.DataFrame()
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def load_fleet_history_from_db(self, restaurant_ids=None):
+        """
+        Loads the history of several restaurants (all of them by default) in one query.
+        Returns a DataFrame formatted like load_history_from_db.
+        """
+        print(f"--- Loading Fleet History from DB ({'all' if restaurant_ids is None else len(restaurant_ids)} restaurants) ---")
+
+        conn = self.get_connection()
+        if not conn:
+            return pd.DataFrame()
+
+        # One row per restaurant and day, deduplicated in the database (see load_history_from_db)
+        query = """
+            SELECT DISTINCT ON (restaurant_id, date_historique)
+                   date_historique, holiday_name, is_holiday, is_school_vacations, vacation_name,
+                   weather_code, tmax, tmin, prcp, wspd, day_of_week, is_weekend,
+                   affluence,  occupancy_rate,  is_full, restaurant_id
+            FROM historique_affluence
+        """
+        params = None
+        if restaurant_ids is not None:
+            query += " WHERE restaurant_id = ANY(%s)"
+            params = (list(restaurant_ids),)
+        query += " ORDER BY restaurant_id, date_historique ASC, id DESC"
+
+        try:
+            df = pd.read_sql_query(query, conn, params=params)
+
+            df['date'] = pd.to_datetime(df['date_historique'])
+            df.drop(columns=['date_historique'], inplace=True)
+            df = df[['date'] + [c for c in df.columns if c != 'date']]
+
+            print(f"Loaded {len(df)} rows for {df['restaurant_id'].nunique()} restaurants.")
+            return df
+
+        except Exception as e:
+            print(f"Error reading fleet history: {e}")
+            return pd.DataFrame()
+        finally:
+            self.release_connection(conn)
 
 # Expose a singleton
 service = DatabaseService()
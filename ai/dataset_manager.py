@@ -7,6 +7,7 @@ import sip_engine
 import psycopg2
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 # Suppress specific SQLAlchemy UserWarning
 warnings.filterwarnings("ignore", ".*pandas only supports SQLAlchemy connection.*")
@@ -75,15 +76,27 @@ class DatasetManager:
         df_main = pd.DataFrame(index=dates)
         df_main.index.name = "date"
 
-        # 2. Fetch Data
-        print("Fetching Holidays...")
-        df_holidays = data_providers.get_jours_ferie_data()
-        
-        print("Fetching School Vacations...")
-        vacations_list = data_providers.get_vacances_scolaires_data(date_start, date_end)
-        
-        print(f"Fetching Weather for {location}...")
-        df_meteo = data_providers.get_historical_weather(date_start, date_end, location)
+        # 2. Fetch Data (network-bound sources fetched concurrently; a failing
+        # source only leaves its own columns at their defaults)
+        print(f"Fetching Holidays, School Vacations and Weather for {location}...")
+        fetches = {
+            "holidays": (data_providers.get_jours_ferie_data, (date_start, date_end), pd.DataFrame),
+            "school vacations": (data_providers.get_vacances_scolaires_data, (date_start, date_end), list),
+            "weather": (data_providers.get_historical_weather, (date_start, date_end, location), pd.DataFrame),
+        }
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(fetches)) as pool:
+            futures = {name: pool.submit(fn, *args) for name, (fn, args, _) in fetches.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"[WARNING] Fetching {name} failed: {e}")
+                    results[name] = fetches[name][2]()
+
+        df_holidays = results["holidays"]
+        vacations_list = results["school vacations"]
+        df_meteo = results["weather"]
 
         # 3. Merge Data
         
@@ -248,15 +261,28 @@ class DatasetManager:
         # Return dataframe
         return df[output_columns].reset_index()
 
-    def load_history_from_db(self, restaurant_id):
+    def load_history_from_db(self, restaurant_id, date_from=None, date_to=None):
         """
         Loads history data using database_service and adds SIP features.
         Returns a DataFrame for the model.
+        date_from / date_to: optional inclusive range (e.g. only the encoder window).
         """
         import database_service
+        import history_cache
         
-        # 1. Load Raw Data from DB
-        df = database_service.service.load_history_from_db(restaurant_id)
+        # 1. Load Raw Data from DB (only the new days when the local copy is enabled)
+        if settings.HISTORY_CACHE:
+            df = history_cache.cache.load(restaurant_id)
+            if not df.empty and (date_from is not None or date_to is not None):
+                dates = df['date'].dt.normalize()
+                mask = pd.Series(True, index=df.index)
+                if date_from is not None:
+                    mask &= dates >= pd.Timestamp(date_from)
+                if date_to is not None:
+                    mask &= dates <= pd.Timestamp(date_to)
+                df = df[mask].reset_index(drop=True)
+        else:
+            df = database_service.service.load_history_from_db(restaurant_id, date_from=date_from, date_to=date_to)
         
         if df.empty:
             return df
@@ -266,5 +292,21 @@ class DatasetManager:
         
         return df
 
+    def load_fleet_history_from_db(self, restaurant_ids=None):
+        """
+        Loads the history of several restaurants (all by default) and adds SIP features.
+        Returns a DataFrame for the global model.
+        """
+        import database_service
+
+        df = database_service.service.load_fleet_history_from_db(restaurant_ids)
+
+        if df.empty:
+            return df
+
+        df = self.add_sip_features(df)
+
+        return df
+
 # Singleton
 manager = DatasetManager()
@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+import settings
+from geocoding import normalize_address
+
+
+class EventCache:
+    """
+    Events found by Gemini for an address and a date, persisted in a SQLite
+    file shared by every process. An entry is fresh for EVENT_CACHE_TTL_HOURS,
+    or EVENT_CACHE_NEAR_TTL_HOURS for dates less than EVENT_CACHE_NEAR_DAYS
+    away (late announcements matter most there). Only real Gemini answers
+    are stored, never the weather-only fallback.
+    """
+    def __init__(self, path=settings.EVENT_CACHE_PATH,
+                 ttl_hours=settings.EVENT_CACHE_TTL_HOURS,
+                 near_days=settings.EVENT_CACHE_NEAR_DAYS,
+                 near_ttl_hours=settings.EVENT_CACHE_NEAR_TTL_HOURS):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.near_days = near_days
+        self.near_ttl_seconds = near_ttl_hours * 3600
+        self._schema_ready = False
+
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._schema_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    address TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    events TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (address, date)
+                )
+            """)
+            self._schema_ready = True
+        return conn
+
+    def _ttl_seconds(self, date_str, today=None):
+        today = today or date.today()
+        days_ahead = (datetime.strptime(date_str, "%Y-%m-%d").date() - today).days
+        return self.near_ttl_seconds if days_ahead < self.near_days else self.ttl_seconds
+
+    def get_many(self, address, dates):
+        """{date: events} of the fresh entries among dates (YYYY-MM-DD strings)."""
+        key = normalize_address(address)
+        if not key or not dates:
+            return {}
+        try:
+            conn = self._connect()
+            try:
+                placeholders = ",".join("?" for _ in dates)
+                rows = conn.execute(
+                    f"SELECT date, events, fetched_at FROM events WHERE address = ? AND date IN ({placeholders})",
+                    [key, *dates]
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Event cache unavailable: {e}")
+            return {}
+
+        now = time.time()
+        return {
+            date_str: json.loads(events)
+            for date_str, events, fetched_at in rows
+            if now - fetched_at < self._ttl_seconds(date_str)
+        }
+
+    def put_many(self, address, events_by_date):
+        """Stores {date: events} for address."""
+        key = normalize_address(address)
+        if not key or not events_by_date:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO events (address, date, events, fetched_at) VALUES (?, ?, ?, ?)",
+                        [(key, date_str, json.dumps(events, ensure_ascii=False), now) for date_str, events in events_by_date.items()]
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Could not store events of '{key}': {e}")
+
+# Singleton
+cache = EventCache()
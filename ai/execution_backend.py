@@ -0,0 +1,265 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import settings
+
+
+# How often each worker publishes its metrics to the server process
+WORKER_METRICS_SECONDS = 5
+
+
+def _publish_metrics(worker_metrics):
+    """Copies the worker's metrics (DB pool usage...) to the shared dict, periodically."""
+    from metrics import metrics
+    while True:
+        try:
+            worker_metrics[os.getpid()] = metrics.snapshot()
+        except Exception:
+            return # Manager shut down
+        time.sleep(WORKER_METRICS_SECONDS)
+
+
+def _init_worker(threads_per_worker, ready_queue=None, worker_metrics=None):
+    """
+    Limits torch intra-op threads so N workers don't oversubscribe the cores.
+    With ready_queue, also preloads the ML stack (torch, lightning,
+    pytorch_forecasting, Gemini SDK) before the process takes any task, and
+    reports (pid, seconds, error) to ready_queue.
+    With worker_metrics (shared dict), publishes the process metrics to it.
+    """
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    if worker_metrics is not None:
+        threading.Thread(target=_publish_metrics, args=(worker_metrics,), daemon=True).start()
+    if ready_queue is None:
+        return
+
+    started = time.perf_counter()
+    try:
+        import main
+        import model_prediction_affluence
+    except Exception as e:
+        # Raising here would break the whole pool: report it instead
+        ready_queue.put((os.getpid(), None, str(e)))
+        return
+    ready_queue.put((os.getpid(), time.perf_counter() - started, None))
+
+
+def _pipeline_task(progress_queue, cancel_event, epochs, restaurant_id):
+    """Runs inside a worker process. Progress dicts go back through progress_queue."""
+    import main
+    main.execute_pipeline(epochs, restaurant_id, progress_queue.put, cancel_event)
+
+
+class PredictionExecutor:
+    """
+    Bounded pool of worker processes running the prediction pipeline.
+    Training and prediction happen in the workers, so the uvicorn event loop
+    only relays progress messages.
+    """
+    def __init__(self, max_workers=settings.PREDICTION_WORKERS):
+        self.max_workers = max_workers
+        self._pool = None
+        self._manager = None
+        self._ready_queue = None
+        self._worker_metrics = None
+        self._lock = threading.Lock()
+        self._warm_up_started = None
+        self._warm_up_seconds = None
+        self._warm_workers = {}
+        self._failed_workers = {}
+
+    def _ensure_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # "spawn" avoids forking a process that may already hold torch threads
+                context = multiprocessing.get_context("spawn")
+                threads_per_worker = max(1, (os.cpu_count() or 1) // self.max_workers)
+                # The manager outlives broken pools: cancel events stay valid
+                if self._manager is None:
+                    self._manager = context.Manager()
+                    self._worker_metrics = self._manager.dict()
+                self._ready_queue = self._manager.Queue()
+                self._warm_workers = {}
+                self._failed_workers = {}
+                self._warm_up_seconds = None
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(threads_per_worker, self._ready_queue, self._worker_metrics)
+                )
+                threading.Thread(target=self._collect_warm_up, args=(self._ready_queue,), daemon=True).start()
+            return self._pool
+
+    def _replace_pool(self, broken):
+        """
+        A dead worker (e.g. killed by the OOM killer) breaks the whole pool:
+        shut it down and start a new warm one. Returns the current pool.
+        """
+        with self._lock:
+            replaced = self._pool is broken
+            if replaced:
+                print("[WARNING] Worker pool broken, starting a new one.")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                try:
+                    self._ready_queue.put(None) # Stops the warm-up collector of the old pool
+                except Exception:
+                    pass
+        if replaced:
+            self.warm_up()
+        return self._ensure_pool()
+
+    def _collect_warm_up(self, ready_queue):
+        """Records the preload report of every worker process (see _init_worker)."""
+        warm_workers, failed_workers = self._warm_workers, self._failed_workers
+        while True:
+            try:
+                report = ready_queue.get()
+            except Exception:
+                return # Manager shut down
+            if report is None:
+                return # Pool replaced
+            pid, seconds, error = report
+            if error is None:
+                warm_workers[pid] = seconds
+            else:
+                failed_workers[pid] = error
+                print(f"[WARNING] Worker {pid} could not preload the ML stack: {error}")
+
+            if (self._warm_up_seconds is None and self._warm_up_started is not None
+                    and len(warm_workers) >= self.max_workers):
+                self._warm_up_seconds = time.perf_counter() - self._warm_up_started
+                print(f"ML stack warm in {self._warm_up_seconds:.1f}s ({self.max_workers} workers).")
+
+    def warm_up(self):
+        """
+        Starts every worker, which preloads the ML stack in its initializer,
+        in the background: returns immediately so the server can bind its socket.
+        """
+        pool = self._ensure_pool()
+        self._warm_up_started = time.perf_counter()
+        # With no idle worker, each submit spawns a new process (up to max_workers)
+        for _ in range(self.max_workers):
+            pool.submit(os.getpid)
+
+    def _live_pids(self):
+        pool = self._pool
+        processes = dict(getattr(pool, "_processes", None) or {})
+        return {pid for pid, process in processes.items() if process.is_alive()}
+
+    def readiness(self):
+        """Warm-up state of the live workers, for the readiness endpoint."""
+        live = self._live_pids()
+        warm = len(live.intersection(self._warm_workers))
+        failed = len(live.intersection(self._failed_workers))
+        return {
+            "ready": warm >= self.max_workers and not failed,
+            "workers": self.max_workers,
+            "warm_workers": warm,
+            "failed_workers": failed,
+            "warm_up_seconds": round(self._warm_up_seconds, 2) if self._warm_up_seconds is not None else None,
+        }
+
+    def worker_metrics(self):
+        """
+        Metrics of the worker processes (where the pipeline, and so most DB
+        pool usage, runs), published every WORKER_METRICS_SECONDS: counters
+        summed over every worker since startup, gauges over the live ones.
+        """
+        shared = self._worker_metrics
+        try:
+            snapshots = dict(shared) if shared is not None else {}
+        except Exception:
+            snapshots = {} # Manager shut down
+        live = self._live_pids()
+        counters, gauges = {}, {}
+        for pid, snapshot in snapshots.items():
+            for name, value in snapshot["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+            if pid in live:
+                for name, value in snapshot["gauges"].items():
+                    gauges[name] = gauges.get(name, 0) + value
+        return {"workers": len(live), "counters": counters, "gauges": gauges}
+
+    def new_cancel_event(self):
+        """Event shared with the worker processes, to cancel a run cooperatively."""
+        self._ensure_pool()
+        return self._manager.Event()
+
+    async def stream(self, epochs, restaurant_id, cancel_event=None):
+        """
+        Async generator yielding the pipeline status dicts as they are produced
+        by the worker process. Setting cancel_event (see new_cancel_event) makes
+        the run stop at its next step.
+        """
+        # Pool/manager creation, manager calls and submit (which may spawn a
+        # worker) all block: run them off the event loop
+        pool = await asyncio.to_thread(self._ensure_pool)
+        loop = asyncio.get_running_loop()
+        channel = asyncio.Queue()
+        progress_queue = await asyncio.to_thread(self._manager.Queue)
+
+        try:
+            future = await asyncio.to_thread(pool.submit, _pipeline_task, progress_queue, cancel_event, epochs, restaurant_id)
+        except BrokenProcessPool:
+            pool = await asyncio.to_thread(self._replace_pool, pool)
+            future = await asyncio.to_thread(pool.submit, _pipeline_task, progress_queue, cancel_event, epochs, restaurant_id)
+
+        def on_done(f):
+            # The worker always ends with a None sentinel, unless it crashed or never ran
+            if f.cancelled():
+                final = {"status": "cancelled", "message": "Prediction run cancelled before it started."}
+            elif f.exception() is not None:
+                final = {"status": "error", "message": f"Worker failure: {f.exception()}"}
+                if isinstance(f.exception(), BrokenProcessPool):
+                    # Next runs get a new pool without waiting for a failed submit
+                    threading.Thread(target=self._replace_pool, args=(pool,), daemon=True).start()
+            else:
+                return
+            try:
+                progress_queue.put(final)
+                progress_queue.put(None)
+            except Exception as e:
+                # Manager already shut down: pump() ends the stream itself
+                print(f"[WARNING] Could not report the end of the run: {e}")
+
+        future.add_done_callback(on_done)
+
+        def pump():
+            # Bridges the cross-process queue to the asyncio channel
+            while True:
+                try:
+                    msg = progress_queue.get()
+                except Exception as e:
+                    # Manager gone (executor shut down): end the stream instead of blocking
+                    loop.call_soon_threadsafe(channel.put_nowait, {"status": "error", "message": f"Worker failure: {e}"})
+                    msg = None
+                loop.call_soon_threadsafe(channel.put_nowait, msg)
+                if msg is None:
+                    break
+
+        threading.Thread(target=pump, daemon=True).start()
+
+        while True:
+            msg = await channel.get()
+            if msg is None:
+                break
+            yield msg
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._manager.shutdown()
+                self._pool = None
+                self._manager = None
+                self._worker_metrics = None
+
+# Singleton
+executor = PredictionExecutor()
@@ -1,29 +1,110 @@
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-from google import genai
-from google.genai import types
+import numpy as np
 import settings
 import sip_engine
 import data_providers
+import event_cache
+
+# Structured output of the Gemini call: one object per date
+EVENTS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "date": {"type": "string", "description": "YYYY-MM-DD"},
+            "events": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "nom": {"type": "string"},
+                        "categorie": {"type": "string", "enum": ["SPORT", "CONCERT", "BUSINESS", "FAMILLE", "CULTURE", "FETE", "SPECIAL", "AUTRE"]},
+                        "type_lieu": {"type": "string", "enum": ["INTERIEUR", "EXTERIEUR"]},
+                        "affluence_estimee_personnes": {"type": "integer"},
+                        "distance_metres": {"type": "integer"},
+                        "horaire_debut": {"type": "string", "description": "HH:MM"}
+                    },
+                    "required": ["nom", "categorie", "type_lieu", "distance_metres"]
+                }
+            }
+        },
+        "required": ["date", "events"]
+    }
+}
+
+
+class JsonArrayStream:
+    """
+    Incremental parser of a streamed JSON array: feed() the text chunks as
+    they arrive, it returns the top-level objects completed so far.
+    """
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        items = []
+        for char in text:
+            if self._depth >= 2 or (self._depth == 1 and char == "{"):
+                self._buffer.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if self._depth == 1 and char == "}":
+                    items.append(json.loads("".join(self._buffer)))
+                    self._buffer = []
+        return items
+
 
 class GeminiService:
     def __init__(self):
-        self.client = self._get_client()
+        # The SDK and its client are loaded on first use, not at import time
+        self._client = None
+        self._client_loaded = False
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if not self._client_loaded:
+                self._client = self._get_client()
+                self._client_loaded = True
+            return self._client
 
     def _get_client(self):
         try:
             api_key = settings.GEMINI_API_KEY
             if not api_key:
                 return None
+            from google import genai
             return genai.Client(api_key=api_key)
         except Exception as e:
             print(f"Error configuring Gemini client: {e}")
             return None
 
-    def get_future_data_with_sip(self, date_debut, date_fin, restaurant_config):
+    def get_future_data_with_sip(self, date_debut, date_fin, restaurant_config, on_day=None):
         """
         Executes the SIP pipeline: Weather -> Gemini Analysis -> SIP Calculation
+        on_day(date, events) is called for each date as soon as its events are
+        known (cached dates first, then as Gemini streams them).
         """
         if not self.client:
             print("Gemini Client not initialized (Missing Key?). Returning basic weather data.")
@@ -41,8 +122,6 @@ class GeminiService:
         current_date_obj = datetime.strptime(date_debut, "%Y-%m-%d")
         end_date_obj = datetime.strptime(date_fin, "%Y-%m-%d")
         
-        prompt_days_context = ""
-        
         while current_date_obj <= end_date_obj:
             date_str = current_date_obj.strftime("%Y-%m-%d")
             days_fr = ["LUNDI", "MARDI", "MERCREDI", "JEUDI", "VENDREDI", "SAMEDI", "DIMANCHE"]
@@ -56,71 +135,189 @@ class GeminiService:
             
             ext_factors = sip_engine.calculer_facteurs_externes_sip(w_code, t_max, day_index >= 5)
             
-            prompt_days_context += f"- Date: {date_str} ({day_name})\n"
-            prompt_days_context += f"  Météo: {w_desc} (Code {w_code}), Max: {t_max}°C\n"
-            prompt_days_context += f"  Facteurs pré-calculés: {json.dumps(ext_factors)}\n\n"
+            prompt_context = f"- Date: {date_str} ({day_name})\n"
+            prompt_context += f"  Météo: {w_desc} (Code {w_code}), Max: {t_max}°C\n"
+            prompt_context += f"  Facteurs pré-calculés: {json.dumps(ext_factors)}\n\n"
             
             days_list.append({
                 "date": date_str,
                 "day_name": day_name,
                 "weather": w_info,
-                "ext_factors": ext_factors
+                "ext_factors": ext_factors,
+                "prompt_context": prompt_context
             })
             current_date_obj += timedelta(days=1)
 
-        # 3. Call Gemini
-        global_results = self._call_gemini_batch(prompt_days_context, days_list, restaurant_config)
+        # 3. Events: dates already analysed for this address come from the
+        # cache (see event_cache), Gemini is only asked about the others
+        address = restaurant_config.get("full_address", "")
+        events_by_date = event_cache.cache.get_many(address, [d["date"] for d in days_list])
+        missing_days = [d for d in days_list if d["date"] not in events_by_date]
+        if events_by_date:
+            print(f"  -> Events of {len(events_by_date)}/{len(days_list)} dates from cache.")
+            if on_day:
+                for date_str in sorted(events_by_date):
+                    on_day(date_str, events_by_date[date_str])
 
-        # 4. Post-Process with SIP Engine
-        final_output = []
-        
-        for day_res in global_results:
-            date_analysee = day_res.get("date")
-            context_day = next((d for d in days_list if d["date"] == date_analysee), None)
-            if not context_day: continue
+        if missing_days:
+            fetched = self._call_gemini_batch(missing_days, restaurant_config, on_day)
+            event_cache.cache.put_many(address, fetched)
+            events_by_date.update(fetched)
 
-            day_name = context_day["day_name"]
-            w_code = context_day["weather"].get("code", 0)
-            t_max = context_day["weather"].get("temp_max", 0)
+        # 4. Post-Process with SIP Engine: every event of the window is scored
+        # in one vectorized pass (dates Gemini could not cover have no event)
+        urban_context = restaurant_config.get("urban_context", "MOYEN")
+        type_resto = restaurant_config.get("type_restaurant", "BRASSERIE")
 
-            impact_total_soir = 0.0
-            events_processed = []
-            
-            for event in day_res.get("events", []):
-                nom = event.get("nom", "Inconnu")
-                cat = event.get("categorie", "AUTRE")
-                dist = event.get("distance_metres", 5000)
-                lieu = event.get("type_lieu", "INTERIEUR")
-                
-                if "Valentin" in nom or "Mère" in nom: cat = "SPECIAL"
-
-                base_ratio = sip_engine.get_impact_base(cat, 'soir_pre', restaurant_config.get("urban_context", "MOYEN"), restaurant_config.get("type_restaurant", "BRASSERIE"))
-                impact_dist = sip_engine.calcul_impact_distance(base_ratio, dist, restaurant_config.get("urban_context", "MOYEN"))
-                weather_mod = sip_engine.get_weather_event_modifier(w_code, lieu)
-                impact_final = impact_dist * weather_mod
-                
-                impact_total_soir += impact_final
-                
-                event["impact_final_sip"] = impact_final
-                events_processed.append(event)
+        day_of_event, events = [], []
+        for i, context_day in enumerate(days_list):
+            for event in events_by_date.get(context_day["date"], []):
+                day_of_event.append(i)
+                events.append(event)
+
+        categories = [
+            "SPECIAL" if "Valentin" in event.get("nom", "Inconnu") or "Mère" in event.get("nom", "Inconnu")
+            else event.get("categorie", "AUTRE")
+            for event in events
+        ]
+        impacts = sip_engine.event_impacts(
+            categories,
+            [5000 if event.get("distance_metres") is None else event["distance_metres"] for event in events],
+            [event.get("type_lieu") or "INTERIEUR" for event in events],
+            [days_list[i]["weather"].get("code", 0) for i in day_of_event],
+            urban_context,
+            type_resto
+        )
+        impact_total_soir = np.bincount(np.asarray(day_of_event, dtype=int), weights=impacts, minlength=len(days_list))
+
+        events_processed = [[] for _ in days_list]
+        for i, event, impact_final in zip(day_of_event, events, impacts):
+            event["impact_final_sip"] = float(impact_final)
+            events_processed[i].append(event)
 
+        final_output = []
+        
+        for i, context_day in enumerate(days_list):
+            day_name = context_day["day_name"]
             base_jour = sip_engine.IMPACT_BASE_JOUR.get(day_name, 0.1)
-            sip = base_jour + impact_total_soir
+            sip = base_jour + float(impact_total_soir[i])
             
             final_output.append({
-                "date": date_analysee,
+                "date": context_day["date"],
                 "day_of_week": day_name, 
-                "weather_code": w_code,
-                "tmax": t_max,
+                "weather_code": context_day["weather"].get("code", 0),
+                "tmax": context_day["weather"].get("temp_max", 0),
                 "sip": sip,
-                "events": events_processed
+                "events": events_processed[i]
             })
             
         return final_output
 
-    def _call_gemini_batch(self, days_context, days_list_fallback, restaurant_config):
-        if not self.client:
-            return self._fallback_results(days_list_fallback)
+    def _call_gemini_batch(self, days_list, restaurant_config, on_day=None):
+        """
+        Asks Gemini for the events of days_list. Returns {date: events} for
+        the dates it answered, {} when it is unavailable (weather-only fallback).
+        on_day(date, events) is called once per date, as soon as it is parsed,
+        and never after this method has returned.
+        The dates are split in chunks of GEMINI_CHUNK_DAYS queried concurrently.
+        Each attempt has its own GEMINI_TIMEOUT_SECONDS deadline. A chunk still
+        running after GEMINI_HEDGE_AFTER_SECONDS (or failed) is sent a second
+        time and the first answer wins, so a chunk may take up to
+        GEMINI_HEDGE_AFTER_SECONDS + GEMINI_TIMEOUT_SECONDS. A slow or failed
+        chunk only loses its own dates.
+        """
+        if settings.OFFLINE_MODE or not self.client:
+            print("Using fallback (Weather only).")
+            return {}
+
+        size = max(1, settings.GEMINI_CHUNK_DAYS)
+        chunks = [days_list[i:i + size] for i in range(0, len(days_list), size)]
+        hedge_after = settings.GEMINI_HEDGE_AFTER_SECONDS
+        timeout = settings.GEMINI_TIMEOUT_SECONDS
+        started = time.monotonic()
+
+        # Dates streamed by any attempt are kept, even if that attempt fails
+        # later; the hedged duplicate of a date is ignored. Once closed is set,
+        # late attempts stop streaming and forward nothing.
+        results = {}
+        results_lock = threading.Lock()
+        closed = threading.Event()
+
+        def on_streamed_day(date_str, events):
+            with results_lock:
+                if closed.is_set() or date_str in results:
+                    return
+                results[date_str] = events
+                if on_day:
+                    on_day(date_str, events)
+
+        pool = ThreadPoolExecutor(max_workers=len(chunks) * (2 if hedge_after > 0 else 1))
+
+        def submit(i):
+            future = pool.submit(self._query_gemini, chunks[i], restaurant_config, on_streamed_day, closed)
+            attempts[i].append((future, time.monotonic()))
+
+        def can_hedge(i):
+            return hedge_after > 0 and len(attempts[i]) < 2
+
+        def dates(i):
+            return f"{chunks[i][0]['date']} -> {chunks[i][-1]['date']}"
+
+        attempts = {i: [] for i in range(len(chunks))}
+        for i in attempts:
+            submit(i)
+        pending = set(attempts)
+
+        try:
+            while pending:
+                now = time.monotonic()
+                for i in sorted(pending):
+                    futures = [f for f, _ in attempts[i]]
+                    if any(f.done() and f.exception() is None for f in futures):
+                        pending.discard(i)
+                    elif all(f.done() for f in futures):
+                        print(f"Gemini API Error (dates {dates(i)}): {futures[-1].exception()}")
+                        if can_hedge(i):
+                            submit(i)
+                        else:
+                            pending.discard(i)
+                    elif can_hedge(i) and now - started >= hedge_after:
+                        print(f"  -> Hedging slow Gemini call (dates {dates(i)})")
+                        submit(i)
+                    elif all(f.done() or now >= t + timeout for f, t in attempts[i]):
+                        print(f"Gemini deadline exceeded for dates {dates(i)}.")
+                        pending.discard(i)
+
+                if not pending:
+                    break
+                # Wake up at the next attempt deadline or hedge time, or on completion
+                wakeups = []
+                for i in pending:
+                    wakeups += [t + timeout for f, t in attempts[i] if not f.done()]
+                    if can_hedge(i):
+                        wakeups.append(started + hedge_after)
+                running = [f for i in pending for f, _ in attempts[i] if not f.done()]
+                wait(running, timeout=max(0.0, min(wakeups) - time.monotonic()), return_when=FIRST_COMPLETED)
+        finally:
+            # Late calls are abandoned, not awaited: they stop at their next streamed chunk
+            with results_lock:
+                closed.set()
+                results = dict(results)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if not results:
+            print("Using fallback (Weather only).")
+        return results
+
+    def _query_gemini(self, days_list, restaurant_config, on_day=None, cancel_event=None):
+        """
+        One streamed Gemini call for days_list. Returns {date: events}; raises
+        on failure. on_day(date, events) is called for each date as it arrives.
+        cancel_event: once set, the stream is closed at the next chunk.
+        """
+        days_context = "".join(d["prompt_context"] for d in days_list)
+
+        from google.genai import types
         
         SYSTEM_INSTRUCTION = """
         Tu es un extracteur de données strict spécialisé en FoodTech et Yield Management.
@@ -132,27 +329,8 @@ class GeminiService:
         3. Ne cherche PAS les vacances scolaires ni les jours fériés standards 'inertes' (comme le 8 mai sans event), sauf s'ils impliquent une sortie festive spéciale.
         4. Pour chaque événement, détermine s'il a lieu en INTÉRIEUR ou en EXTÉRIEUR.
         5. Si aucune information n'est trouvée pour une date spécifique, retourne une liste d'événements vide pour cette date.
-        6. Retourne UNIQUEMENT une liste JSON d'objets.
-
-        Consignes de Formatage (JSON Strict) :
-        [
-          {
-            "date": "YYYY-MM-DD",
-            "adresse": "...",
-            "facteurs_externes_normalises": { ... }, 
-            "events": [
-              {
-                 "nom": "string",
-                 "categorie": "SPORT" | "CONCERT" | "BUSINESS" | "FAMILLE" | "CULTURE" | "FETE" | "SPECIAL" | "AUTRE",
-                 "type_lieu": "INTERIEUR" | "EXTERIEUR",
-                 "affluence_estimee_personnes": int,
-                 "distance_metres": int,
-                 "horaire_debut": "HH:MM"
-              }
-            ]
-          },
-          ...
-        ]
+        6. Retourne un objet par date fournie, dans l'ordre des dates.
+        7. Pour chaque événement, indique sa catégorie (SPORT, CONCERT, BUSINESS, FAMILLE, CULTURE, FETE, SPECIAL, AUTRE), l'affluence estimée, la distance au restaurant en mètres et l'heure de début (HH:MM).
         """
 
         USER_PROMPT = f"""
@@ -162,44 +340,39 @@ class GeminiService:
         {days_context}
         """
         
-        try:
-            print("  -> Calling Gemini API...")
-            response = self.client.models.generate_content(
-                model='gemini-3-flash-preview',
-                contents=SYSTEM_INSTRUCTION + "\n\n" + USER_PROMPT,
-                config=types.GenerateContentConfig(
-                    tools=[types.Tool(google_search=types.GoogleSearch())]
-                )
+        print(f"  -> Calling Gemini API ({days_list[0]['date']} -> {days_list[-1]['date']})...")
+        stream = self.client.models.generate_content_stream(
+            model='gemini-3-flash-preview',
+            contents=SYSTEM_INSTRUCTION + "\n\n" + USER_PROMPT,
+            config=types.GenerateContentConfig(
+                tools=[types.Tool(google_search=types.GoogleSearch())],
+                response_mime_type="application/json",
+                response_json_schema=EVENTS_SCHEMA,
+                http_options=types.HttpOptions(timeout=int(settings.GEMINI_TIMEOUT_SECONDS * 1000))
             )
-            print("  -> Gemini API returned.")
-            
-            raw_text = ""
-            if response.text:
-                raw_text = response.text.replace("```json", "").replace("```", "").strip()
-            
-            if raw_text.startswith("{"):
-                raw_text = f"[{raw_text}]"
-            
-            print("Gemini's response :", raw_text)
+        )
 
-            return json.loads(raw_text)
+        # Each date is handed to on_day as soon as its object is complete
+        requested = {d["date"] for d in days_list}
+        parser = JsonArrayStream()
+        results = {}
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                # Nobody waits for this answer any more: stop downloading it
+                stream.close()
+                print(f"  -> Gemini call abandoned ({days_list[0]['date']} -> {days_list[-1]['date']}).")
+                return results
+            for day in parser.feed(chunk.text or ""):
+                if isinstance(day, dict) and day.get("date") in requested:
+                    results[day["date"]] = day.get("events", [])
+                    if on_day:
+                        on_day(day["date"], results[day["date"]])
+        print(f"  -> Gemini API returned {len(results)}/{len(days_list)} dates.")
 
-        except Exception as e:
-            print(f"Gemini API Error: {e}")
-            return self._fallback_results(days_list_fallback)
-
-    def _fallback_results(self, days_list):
-        print("Using fallback (Weather only).")
-        results = []
-        for d in days_list:
-            results.append({
-                "date": d["date"],
-                "events": [] 
-            })
         return results
 
 # Singleton instance
 service = GeminiService()
 
-def get_future_data(date_debut, date_fin, restaurant_config):
-    return service.get_future_data_with_sip(date_debut, date_fin, restaurant_config)
+def get_future_data(date_debut, date_fin, restaurant_config, on_day=None):
+    return service.get_future_data_with_sip(date_debut, date_fin, restaurant_config, on_day)
@@ -1,82 +1,102 @@
 import argparse
+import io
+import time
 import pandas as pd
-import psycopg2
 from psycopg2 import sql
 import settings
 from dataset_manager import manager
+from database_service import service
+import history_cache
 import sys
-import os
-
-# DB Configuration - Fallback to defaults if not in settings or env
-DB_HOST = os.environ.get("DB_HOST", "localhost")
-DB_PORT = os.environ.get("DB_PORT", "5432")
-DB_NAME = os.environ.get("DB_NAME", "emergency_db")
-DB_USER = os.environ.get("DB_USER", "admin")
-DB_PASSWORD = os.environ.get("DB_PASSWORD", "admin")
 
 def connect_db():
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
+    # Borrowed from the shared pool of database_service (same DB_* settings)
+    conn = service.get_connection()
+    if conn is None:
         sys.exit(1)
+    return conn
+
+# Columns of historique_affluence written by export_to_db, in COPY order
+EXPORT_COLUMNS = [
+    "date_historique", "holiday_name", "is_holiday", "is_school_vacations", "vacation_name",
+    "weather_code", "tmax", "tmin", "prcp", "wspd", "day_of_week", "is_weekend",
+    "affluence", "occupancy_rate", "is_full", "restaurant_id"
+]
+
+def to_export_frame(df, restaurant_id):
+    """Maps the generated DataFrame (indexed by date) to the DB schema, column-wise."""
+    def column(name, default=0):
+        return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+    out = pd.DataFrame(index=df.index)
+    out["date_historique"] = pd.to_datetime(df.index)
+    out["holiday_name"] = column("holiday_name", None)
+    out["is_holiday"] = column("is_holiday").fillna(0).astype(bool)
+    out["is_school_vacations"] = column("is_school_vacations").fillna(0).astype(bool)
+    out["vacation_name"] = column("vacation_name", None)
+    out["weather_code"] = column("weather_code").fillna(0).round().astype(int)
+    for name in ["tmax", "tmin", "prcp", "wspd"]:
+        out[name] = column(name).fillna(0).astype(float).round(1)
+    out["day_of_week"] = column("day_of_week", None)
+    out["is_weekend"] = column("is_weekend").fillna(0).astype(bool)
+    out["affluence"] = column("affluence").fillna(0).round().astype(int)
+    out["occupancy_rate"] = column("occupancy_rate").fillna(0).astype(float)
+    out["is_full"] = column("is_full").fillna(0).astype(bool)
+    out["restaurant_id"] = int(restaurant_id)
+    return out[EXPORT_COLUMNS]
 
 def export_to_db(df, restaurant_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-    
+    """
+    Bulk upsert of the generated history: rows are streamed with COPY into a
+    temporary table, then replace the existing rows of the same
+    (restaurant_id, date_historique) in one transaction, so re-running an
+    export never creates duplicates. Returns the number of rows written.
+    """
     print(f"Exporting {len(df)} rows to database for restaurant_id {restaurant_id}...")
+    started = time.perf_counter()
+
+    frame = to_export_frame(df, restaurant_id)
+    # Last value wins if the DataFrame itself has a day twice
+    frame = frame.drop_duplicates(subset="date_historique", keep="last")
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+    buffer.seek(0)
+
+    columns = sql.SQL(", ").join(sql.Identifier(c) for c in EXPORT_COLUMNS)
+    conn = connect_db()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("CREATE TEMP TABLE historique_import ON COMMIT DROP AS SELECT {} FROM historique_affluence WITH NO DATA").format(columns)
+            )
+            cursor.copy_expert(
+                sql.SQL("COPY historique_import ({}) FROM STDIN WITH (FORMAT csv)").format(columns).as_string(conn),
+                buffer
+            )
+            cursor.execute("""
+                DELETE FROM historique_affluence h
+                USING historique_import i
+                WHERE h.restaurant_id = i.restaurant_id AND h.date_historique = i.date_historique
+            """)
+            replaced = cursor.rowcount
+            cursor.execute(
+                sql.SQL("INSERT INTO historique_affluence ({0}) SELECT {0} FROM historique_import").format(columns)
+            )
+            written = cursor.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error exporting history: {e}")
+        return 0
+    finally:
+        service.release_connection(conn)
+
+    # Rewritten days are not seen by the incremental reload
+    history_cache.cache.invalidate(restaurant_id)
 
-    query = sql.SQL("""
-        INSERT INTO historique_affluence (
-            date_historique, holiday_name, is_holiday, is_school_vacations, vacation_name,
-            weather_code, tmax, tmin, prcd, wspd, day_of_week, is_weekend,
-            affluence, pourcentage_occupation, is_complet, restaurant_id
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        )
-    """)
-
-    for index, row in df.iterrows():
-        # Map values from DataFrame to DB Schema
-        date_historique = index
-        holiday_name = row.get('holiday_name') if pd.notna(row.get('holiday_name')) else None
-        is_holiday = bool(row.get('is_holiday', 0))
-        is_school_vacations = bool(row.get('is_school_vacations', 0))
-        vacation_name = row.get('vacation_name') if pd.notna(row.get('vacation_name')) else None
-        weather_code = int(row.get('weather_code', 0))
-        tmax = int(round(row.get('tmax', 0)))
-        tmin = int(round(row.get('tmin', 0)))
-        prcd = int(round(row.get('prcp', 0))) # Note: prcp vs prcd in generated dataframe vs db
-        wspd = int(round(row.get('wspd', 0)))
-        day_of_week = row.get('day_of_week')
-        is_weekend = bool(row.get('is_weekend', 0))
-        affluence = int(row.get('affluence', 0))
-        pourcentage_occupation = int(row.get('occupancy_rate', 0))
-        is_complet = bool(row.get('is_full', 0))
-
-        try:
-            cursor.execute(query, (
-                date_historique, holiday_name, is_holiday, is_school_vacations, vacation_name,
-                weather_code, tmax, tmin, prcd, wspd, day_of_week, is_weekend,
-                affluence, pourcentage_occupation, is_complet, restaurant_id
-            ))
-        except Exception as e:
-            print(f"Error inserting row {index}: {e}")
-            conn.rollback()
-            continue
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print("Export complete.")
+    elapsed = time.perf_counter() - started
+    print(f"Export complete: {written} rows ({replaced} replaced) in {elapsed:.2f}s, {written / max(elapsed, 1e-9):,.0f} rows/s.")
+    return written
 
 from datetime import datetime
 
@@ -101,6 +121,7 @@ def main():
     parser.add_argument("--max_covers", type=int, help="Maximum number of covers (restaurant size)")
     parser.add_argument("--base_occupancy", type=float, help="Base occupancy rate (0.0 - 1.0)")
     parser.add_argument("--weather_weight", type=float, help="Impact of weather (0.0 - 1.0)")
+    parser.add_argument("--export_db", action="store_true", help="Also upsert the history into historique_affluence")
 
     args = parser.parse_args()
 
@@ -164,7 +185,8 @@ def main():
     print(f"Exporting history to CSV: {csv_filename}")
     df_result.to_csv(csv_filename)
 
-    # export_to_db(df_result, restaurant_id)
+    if args.export_db:
+        export_to_db(df_result, restaurant_id)
 
 if __name__ == "__main__":
     main()
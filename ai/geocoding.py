@@ -0,0 +1,128 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import settings
+
+
+def normalize_address(address):
+    """Cache key of an address: case, accents, punctuation and spacing are ignored."""
+    text = unicodedata.normalize("NFKD", str(address))
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = re.sub(r"[^\w]+", " ", text)
+    return text.strip()
+
+
+class GeocodeCache:
+    """
+    Address -> (latitude, longitude), persisted in a SQLite file shared by the
+    server, the workers and the scripts. Addresses that Nominatim does not
+    know are cached too (negative entries) and retried after
+    GEOCODE_NEGATIVE_TTL_HOURS; network errors are never cached.
+    A changed address is a different key, so it is geocoded again.
+    """
+    def __init__(self, path=settings.GEOCODE_CACHE_PATH,
+                 ttl_days=settings.GEOCODE_CACHE_TTL_DAYS,
+                 negative_ttl_hours=settings.GEOCODE_NEGATIVE_TTL_HOURS):
+        self.path = path
+        self.ttl_seconds = ttl_days * 86400
+        self.negative_ttl_seconds = negative_ttl_hours * 3600
+        self._geolocator = None
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        if not self._schema_ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._schema_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocode (
+                    address TEXT PRIMARY KEY,
+                    latitude REAL,
+                    longitude REAL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._schema_ready = True
+        return conn
+
+    def _read(self, key):
+        """(found, coordinates) from the cache; found is False on a miss or an expired entry."""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT latitude, longitude, updated_at FROM geocode WHERE address = ?", (key,)
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Geocode cache unavailable: {e}")
+            return False, None
+
+        if row is None:
+            return False, None
+        latitude, longitude, updated_at = row
+        age = time.time() - updated_at
+        if latitude is None:
+            return age < self.negative_ttl_seconds, None
+        return age < self.ttl_seconds, (latitude, longitude)
+
+    def _write(self, key, coordinates):
+        latitude, longitude = coordinates if coordinates else (None, None)
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO geocode (address, latitude, longitude, updated_at) VALUES (?, ?, ?, ?)",
+                        (key, latitude, longitude, time.time())
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Could not store geocode of '{key}': {e}")
+
+    def _get_geolocator(self):
+        with self._lock:
+            if self._geolocator is None:
+                from geopy.geocoders import Nominatim
+                self._geolocator = Nominatim(user_agent="kairoscope_app_v1")
+            return self._geolocator
+
+    def geocode(self, address, timeout=5):
+        """
+        Coordinates (latitude, longitude) of address, or None if it cannot be
+        located. Raises on network errors (nothing is cached then).
+        In offline mode only the cache is used.
+        """
+        key = normalize_address(address)
+        if not key:
+            return None
+
+        found, coordinates = self._read(key)
+        if found:
+            return coordinates
+        if settings.OFFLINE_MODE:
+            # Never touch the network; an expired entry is better than nothing
+            return coordinates
+
+        location = self._get_geolocator().geocode(address, timeout=timeout)
+        coordinates = (location.latitude, location.longitude) if location else None
+        self._write(key, coordinates)
+        return coordinates
+
+    def locate(self, *addresses, timeout=5):
+        """First address of the list that can be located (e.g. full address, then city), or None."""
+        for address in addresses:
+            if address:
+                coordinates = self.geocode(address, timeout=timeout)
+                if coordinates:
+                    return coordinates
+        return None
+
+# Singleton
+geocoder = GeocodeCache()
@@ -0,0 +1,113 @@
+import json
+import os
+import pandas as pd
+import settings
+
+
+def combine_checksums(before, after):
+    """Checksum of two consecutive history ranges (see DatabaseService.history_checksum)."""
+    if before is None or after is None:
+        return None
+    return [before[0] + after[0], before[1] + after[1]]
+
+
+class HistoryCache:
+    """
+    Local Parquet copy of each restaurant's history (as returned by
+    DatabaseService.load_history_from_db). The last cached date is the
+    watermark: later loads only query the rows after it and append them, so
+    a load with no new day costs one indexed query for nothing.
+    Next to the copy is the SQL checksum of the history up to the watermark
+    (DatabaseService.history_checksum). When new days arrive, the days
+    already copied are checked against it before appending: if any was
+    added, removed or edited in the database, the copy is rebuilt from
+    scratch. The stored checksum is then extended with the new days only.
+    Limitation: edits of copied days are only seen when the next new day
+    arrives (daily sync), or right away if invalidate() is called.
+    """
+    def __init__(self, directory=settings.HISTORY_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, restaurant_id):
+        return os.path.join(self.directory, f"restaurant_{restaurant_id}.parquet")
+
+    def _meta_path(self, restaurant_id):
+        return os.path.join(self.directory, f"restaurant_{restaurant_id}.json")
+
+    def _read(self, restaurant_id):
+        path = self._path(restaurant_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            print(f"[WARNING] Unreadable history cache {path}: {e}")
+            return None
+
+    def _read_meta(self, restaurant_id):
+        path = self._meta_path(restaurant_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[WARNING] Unreadable history cache metadata {path}: {e}")
+            return None
+
+    def _write(self, restaurant_id, df, checksum):
+        """Stores df and the checksum of the database history up to its last date."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(restaurant_id)
+        meta_path = self._meta_path(restaurant_id)
+        # Atomic replace: several worker processes may refresh the same restaurant
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp_path, index=False)
+            with open(tmp_meta_path, "w", encoding="utf-8") as f:
+                json.dump({"watermark": str(df["date"].max().date()), "checksum": checksum}, f)
+            os.replace(tmp_path, path)
+            os.replace(tmp_meta_path, meta_path)
+        except Exception as e:
+            print(f"[WARNING] Could not write history cache {path}: {e}")
+            for p in (tmp_path, tmp_meta_path):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    def invalidate(self, restaurant_id):
+        for path in (self._path(restaurant_id), self._meta_path(restaurant_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self, restaurant_id):
+        """History DataFrame of the restaurant, synchronized with the database."""
+        import database_service
+        service = database_service.service
+
+        cached = self._read(restaurant_id)
+        meta = self._read_meta(restaurant_id)
+        if cached is not None and not cached.empty and meta is not None:
+            watermark = cached["date"].max().date()
+            if meta["watermark"] == str(watermark):
+                new_rows = service.load_history_from_db(restaurant_id, since=watermark)
+                if new_rows.empty:
+                    return cached
+
+                # The watermark moves: the days already copied must be unchanged
+                checksum = service.history_checksum(restaurant_id, watermark)
+                if checksum is not None and checksum == meta["checksum"]:
+                    df = pd.concat([cached, new_rows], ignore_index=True)
+                    df = df.drop_duplicates(subset="date", keep="last").reset_index(drop=True)
+                    added = service.history_checksum(restaurant_id, df["date"].max().date(), since=watermark)
+                    self._write(restaurant_id, df, combine_checksums(meta["checksum"], added))
+                    return df
+            print(f"History of restaurant {restaurant_id} changed in the database, rebuilding the local copy.")
+
+        df = service.load_history_from_db(restaurant_id)
+        if not df.empty:
+            self._write(restaurant_id, df, service.history_checksum(restaurant_id, df["date"].max().date()))
+        return df
+
+# Singleton
+cache = HistoryCache()
@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+import pandas as pd
+
+# Nationwide French public holidays, named like nager.at's localName.
+# Fixed dates: (month, day, name)
+FIXED_HOLIDAYS = [
+    (1, 1, "Jour de l'an"),
+    (5, 1, "Fête du Travail"),
+    (5, 8, "Victoire 1945"),
+    (7, 14, "Fête nationale"),
+    (8, 15, "Assomption"),
+    (11, 1, "Toussaint"),
+    (11, 11, "Armistice 1918"),
+    (12, 25, "Noël"),
+]
+
+# Moveable holidays: (days after Easter Sunday, name)
+EASTER_HOLIDAYS = [
+    (1, "Lundi de Pâques"),
+    (39, "Ascension"),
+    (50, "Lundi de Pentecôte"),
+]
+
+
+def easter_sunday(year):
+    """Gregorian Easter Sunday (anonymous Gregorian / Meeus algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def holidays_of_year(year):
+    """[(date, name)] of the French public holidays of year, in date order."""
+    easter = easter_sunday(year)
+    days = [(date(year, month, day), name) for month, day, name in FIXED_HOLIDAYS]
+    days += [(easter + timedelta(days=offset), name) for offset, name in EASTER_HOLIDAYS]
+    return sorted(days)
+
+
+def french_holidays(date_start, date_end):
+    """
+    DataFrame indexed by date (holiday_name, is_holiday=1) of the French
+    public holidays between date_start and date_end included, for any range
+    of years. Same shape as the former nager.at based frame.
+    """
+    start, end = pd.Timestamp(date_start), pd.Timestamp(date_end)
+    rows = [day for year in range(start.year, end.year + 1) for day in holidays_of_year(year)]
+
+    df = pd.DataFrame(rows, columns=["date", "holiday_name"])
+    df["date"] = pd.to_datetime(df["date"])
+    df = df[(df["date"] >= start.normalize()) & (df["date"] <= end)]
+    # Ascension can fall on May 1st or 8th: one row per day
+    df = df.drop_duplicates(subset="date").set_index("date")
+    df["is_holiday"] = 1
+    return df
+
+
+def is_holiday(dates):
+    """0/1 array telling which of dates (datetime-like Series) are public holidays."""
+    dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    if dates.empty:
+        return dates.astype(int).to_numpy()
+    holidays = french_holidays(dates.min(), dates.max())
+    return dates.isin(holidays.index).astype(int).to_numpy()
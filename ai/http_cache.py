@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import settings
+
+
+class OfflineError(Exception):
+    """Offline mode and nothing cached for the request."""
+
+
+class HttpCache:
+    """
+    On-disk cache of the JSON answers of the external data sources (one
+    directory per source). Each call gives its TTL: None means the answer
+    never expires (archive weather, past holidays). When the network fails,
+    an expired entry is served instead of nothing. In offline mode
+    (OFFLINE_MODE=1) the network is never used: cached entries are served
+    whatever their age, and OfflineError is raised for the others.
+    """
+    def __init__(self, directory=settings.HTTP_CACHE_DIR, offline=settings.OFFLINE_MODE):
+        self.directory = directory
+        self.offline = offline
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Shared keep-alive session (connection pool per host), usable from several threads."""
+        with self._session_lock:
+            if self._session is None:
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+            return self._session
+
+    def _path(self, source, url, params):
+        raw = json.dumps([url, params], sort_keys=True, default=str)
+        key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, source, f"{key}.json")
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[WARNING] Unreadable HTTP cache entry {path}: {e}")
+            return None
+
+    def _write(self, path, url, params, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"url": url, "params": params, "fetched_at": time.time(), "data": data}
+        # Atomic replace: several worker processes may fetch the same resource
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def get_json(self, source, url, params=None, ttl_seconds=None, timeout=30):
+        """Decoded JSON answer of GET url?params, from the cache when still valid."""
+        path = self._path(source, url, params)
+        entry = self._read(path)
+
+        if entry is not None:
+            if self.offline or ttl_seconds is None or time.time() - entry["fetched_at"] < ttl_seconds:
+                return entry["data"]
+
+        if self.offline:
+            raise OfflineError(f"Offline mode: no cached answer for {source} ({url})")
+
+        try:
+            response = self.session.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            if entry is None:
+                raise
+            age_hours = (time.time() - entry["fetched_at"]) / 3600
+            print(f"[WARNING] {source} unavailable ({e}), using the cached answer from {age_hours:.1f}h ago.")
+            return entry["data"]
+
+        try:
+            self._write(path, url, params, data)
+        except Exception as e:
+            print(f"[WARNING] Could not cache the {source} answer: {e}")
+        return data
+
+# Singleton
+cache = HttpCache()
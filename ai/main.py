@@ -12,72 +12,221 @@ warnings.filterwarnings("ignore")
 import settings
 import dataset_manager
 import model_prediction_affluence
+import model_registry
+import model_export
+import prediction_cache
 
 import threading
 import queue
 import time
+import pandas as pd
 
-def run_prediction_pipeline(epochs=30, restaurant_id=-1):
+# Registry id of the model shared by every restaurant (TRAINING_MODE=global)
+GLOBAL_MODEL_ID = "global"
+
+def warm_start_entry(model_id, df_history, last_date, vocabularies):
     """
-    Generator that yields status updates during the prediction process.
-    Yields dicts with keys: 'status', 'message', 'data'
+    Returns the previous registry entry of the model if it can simply be
+    fine-tuned on the new days, None if a full retrain is needed:
+    no previous model, history not extended, days up to the previous
+    model's last date rewritten, new category values, or last full retrain
+    older than FULL_RETRAIN_DAYS.
     """
-    msg_queue = queue.Queue()
-    
-    def on_progress(msg):
-        msg_queue.put(msg)
+    if not settings.INCREMENTAL_TRAINING:
+        return None
+
+    previous = model_registry.registry.latest(model_id)
+    if previous is None or "full_trained_at" not in previous:
+        return None
+    if last_date <= previous["last_date"]:
+        return None
+    # The previous model was trained on exactly the history up to its last date:
+    # any edited, added or removed row there changes that part's fingerprint
+    known = df_history[pd.to_datetime(df_history["date"]) <= previous["last_date"]]
+    if model_registry.history_fingerprint(known) != previous["fingerprint"]:
+        print("History rewritten before the last training, full retrain.")
+        return None
+    if previous["vocabularies"] != vocabularies:
+        print("Category vocabularies changed, full retrain.")
+        return None
+    if time.time() - previous["full_trained_at"] > settings.FULL_RETRAIN_DAYS * 86400:
+        print("Last full retrain too old, full retrain.")
+        return None
+    return previous
+
+def export_compiled_model(model, df_history, path, time_origin):
+    """
+    Exports the model to TorchScript, traced on the input shapes of a real
+    prediction (default scenarios on the last window of the history).
+    """
+    data = model_prediction_affluence.prepare_training_data(df_history.copy(), time_origin=time_origin)
+    batch, _, _ = model_prediction_affluence.encode_scenarios(
+        model, data, model_prediction_affluence.DEFAULT_SCENARIOS
+    )
+    return model_export.export_model(model, batch, path)
+
+def train_or_reuse_model(model_id, df_history, epochs, on_progress, cancel_event=None):
+    """
+    Returns (model, training_dataset, compiled_path) for the given history: the
+    registry model if it was trained on this exact history, otherwise a
+    fine-tuned or fully retrained one (saved to the registry).
+    training_dataset is None for a registry model: predict_future only needs
+    the dataset parameters stored in the model (see restore_training_dataset
+    to rebuild it).
+    compiled_path is the exported TorchScript model, None if not available.
+    model_id: restaurant_id, or GLOBAL_MODEL_ID for the fleet model.
+    cancel_event: stops training early (PipelineCancelled, nothing registered).
+    """
+    # Reuse the model already trained on this exact history, if any
+    fingerprint = model_registry.history_fingerprint(df_history)
+    entry = model_registry.registry.get(model_id, fingerprint)
+    vocabularies = model_prediction_affluence.category_vocabularies(df_history)
+
+    # A model whose encoders saw other category values (e.g. an older flag
+    # encoding) would map the current ones to the unknown class
+    if entry is not None and entry.get("vocabularies") == vocabularies:
+        on_progress({"status": "message", "message": "Modèle Kairoscope à jour, entraînement ignoré."})
+        return entry["model"], None, entry.get("compiled_path")
+
+    last_date = pd.to_datetime(df_history["date"]).max()
+    previous = warm_start_entry(model_id, df_history, last_date, vocabularies)
+
+    # Training
+    # The callback inside train_tft_model will use on_progress to send epoch updates
+    if previous is not None:
+        on_progress({"status": "message", "message": "Mise à jour incrémentale du modèle Kairoscope..."})
+        model, training_dataset = model_prediction_affluence.train_tft_model(
+            data=model_prediction_affluence.fine_tune_window(df_history, previous["last_date"]),
+            max_epochs=settings.FINE_TUNE_EPOCHS,
+            metrics_callback=on_progress,
+            init_model=previous["model"],
+            dataset_parameters=previous["dataset_parameters"],
+            time_origin=previous["time_origin"],
+            cancel_event=cancel_event
+        )
+        full_trained_at = previous["full_trained_at"]
+        time_origin = previous["time_origin"]
+    else:
+        time_origin = pd.to_datetime(df_history["date"]).min()
+        model, training_dataset = model_prediction_affluence.train_tft_model(
+            data=df_history,
+            max_epochs=epochs,
+            metrics_callback=on_progress,
+            cancel_event=cancel_event
+        )
+        full_trained_at = time.time()
+
+    compiled_path = None
+    if settings.EXPORT_COMPILED_MODELS:
+        compiled_path = export_compiled_model(
+            model, df_history, model_registry.registry.compiled_path(model_id, fingerprint), time_origin
+        )
+
+    model_registry.registry.put(
+        model_id, fingerprint, model, training_dataset,
+        last_date=last_date,
+        vocabularies=vocabularies,
+        time_origin=time_origin,
+        full_trained_at=full_trained_at,
+        compiled_path=compiled_path
+    )
+    return model, training_dataset, compiled_path
+
+def train_global_model(epochs=30, restaurant_ids=None, on_progress=print, cancel_event=None):
+    """
+    Trains (or fine-tunes) the single model shared by the fleet, on the
+    history of all restaurants (or of restaurant_ids) loaded in one pass.
+    """
+    df_fleet = dataset_manager.manager.load_fleet_history_from_db(restaurant_ids)
+    if df_fleet.empty:
+        raise ValueError("No history found to train the global model.")
+    return train_or_reuse_model(GLOBAL_MODEL_ID, df_fleet, epochs, on_progress, cancel_event)
+
+def execute_pipeline(epochs, restaurant_id, on_progress, cancel_event=None, training_mode=None):
+    """
+    Runs the whole prediction pipeline synchronously.
+    Every status dict is passed to on_progress, followed by None when done.
+    Module-level so it can be shipped to a worker process.
+    cancel_event: Event-like object set when nobody waits for the result any more;
+    the pipeline then stops at the next step and reports a 'cancelled' status.
+    training_mode: overrides settings.TRAINING_MODE ('restaurant' or 'global').
+    """
+    training_mode = training_mode or settings.TRAINING_MODE
+    try:
+        model_prediction_affluence.check_cancelled(cancel_event)
+        on_progress({"status": "message", "message": "Chargement des données..."})
         
-    def pipeline_worker():
-        try:
-            on_progress({"status": "message", "message": "Chargement des données..."})
-            
-            # 0. Fetch Restaurant Config from DB
-            import database_service
-            restaurant_config = database_service.service.get_restaurant_config(restaurant_id)
-            
-            if not restaurant_config:
-                 on_progress({"status": "error", "message": f"Restaurant configuration not found for ID {restaurant_id}"})
-                 on_progress(None)
-                 return
-
-            # Fetch data from DB
-            df_history = dataset_manager.manager.load_history_from_db(restaurant_id=restaurant_id)
-
-            # Training
-            # The callback inside train_tft_model will use on_progress to send epoch updates
-            model, training_dataset = model_prediction_affluence.train_tft_model(
-                data=df_history,
-                max_epochs=epochs,
-                metrics_callback=on_progress
-            )
+        # 0. Fetch Restaurant Config from DB
+        import database_service
+        restaurant_config = database_service.service.get_restaurant_config(restaurant_id)
+        
+        if not restaurant_config:
+             on_progress({"status": "error", "message": f"Restaurant configuration not found for ID {restaurant_id}"})
+             on_progress(None)
+             return
+
+        # Fetch data from DB
+        df_history = dataset_manager.manager.load_history_from_db(restaurant_id=restaurant_id)
+
+        # The fleet model is only ever trained by scheduler.py: a request never
+        # trains it, several of them would start the same training at once.
+        # Unknown restaurants are handled by the NaN category of the
+        # restaurant_id encoder.
+        entry = model_registry.registry.latest(GLOBAL_MODEL_ID) if training_mode == "global" else None
+        if entry is not None:
+            model, compiled_path = entry["model"], entry.get("compiled_path")
+            # predict_future only relies on the dataset parameters stored in the model
+            training_dataset = None
+        else:
+            if training_mode == "global":
+                print(f"[WARNING] No global model yet, restaurant {restaurant_id} uses its own model.")
+            model, training_dataset, compiled_path = train_or_reuse_model(restaurant_id, df_history, epochs, on_progress, cancel_event)
+        
+        # Prediction
+        results_df = model_prediction_affluence.predict_future(
+            model, 
+            training_dataset, 
+            history_df=df_history,
+            status_callback=on_progress,
+            restaurant_config=restaurant_config,
+            predictor=model_export.load_predictor(compiled_path),
+            cancel_event=cancel_event
+        )
+        
+        if results_df is not None:
+            # Convert Timestamps to string for JSON serialization
+            results_df["date"] = results_df["date"].astype(str)
             
-            # Prediction
-            results_df = model_prediction_affluence.predict_future(
-                model, 
-                training_dataset, 
-                history_df=df_history,
-                status_callback=on_progress,
-                restaurant_config=restaurant_config
-            )
+            # Convert DataFrame to list of dicts
+            json_output = results_df.to_dict(orient="records")
+
+            # Keep it for the next viewers (see prediction_cache)
+            forecast_start = results_df["date"].iloc[0][:10]
+            prediction_cache.cache.put(restaurant_id, forecast_start, json_output)
             
-            if results_df is not None:
-                # Convert Timestamps to string for JSON serialization
-                results_df["date"] = results_df["date"].astype(str)
-                
-                # Convert DataFrame to list of dicts
-                json_output = results_df.to_dict(orient="records")
-                
-                # Yield the final result
-                on_progress({"status": "output", "payload": json_output})
-                
-            on_progress(None) # Sentinel to signal done
+            # Yield the final result
+            on_progress({"status": "output", "payload": json_output})
             
-        except Exception as e:
-            on_progress({"status": "error", "message": str(e)})
-            on_progress(None)
+        on_progress(None) # Sentinel to signal done
+
+    except model_prediction_affluence.PipelineCancelled as e:
+        print(f"Pipeline cancelled for restaurant {restaurant_id}.")
+        on_progress({"status": "cancelled", "message": str(e)})
+        on_progress(None)
+        
+    except Exception as e:
+        on_progress({"status": "error", "message": str(e)})
+        on_progress(None)
+
+def run_prediction_pipeline(epochs=30, restaurant_id=-1):
+    """
+    Generator that yields status updates during the prediction process.
+    Yields dicts with keys: 'status', 'message', 'data'
+    """
+    msg_queue = queue.Queue()
 
     # Start the worker thread
-    t = threading.Thread(target=pipeline_worker)
+    t = threading.Thread(target=execute_pipeline, args=(epochs, restaurant_id, msg_queue.put))
     t.start()
     
     # Loop and yield messages from the queue until the thread is done
@@ -94,8 +243,7 @@ def run_prediction_pipeline(epochs=30, restaurant_id=-1):
         except queue.Empty:
             if not t.is_alive():
                 break
-            # Yield None to allow the caller (server.py) to await asyncio.sleep
-            # This prevents blocking the event loop during long training steps
+            # Yield None to allow the caller to keep polling between long training steps
             yield None
     
     t.join()
@@ -0,0 +1,27 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Minimal in-process counters and gauges, exposed as JSON by server.py (/metrics).
+    """
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges)}
+
+# Singleton
+metrics = Metrics()
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import torch
+import settings
+
+
+class _TensorInputModel(torch.nn.Module):
+    """
+    Wraps the TFT so it takes the encoded tensors positionally and returns the
+    rescaled quantiles only: a plain signature that torch.jit.trace can record.
+    """
+    def __init__(self, model, keys):
+        super().__init__()
+        self.model = model
+        self.keys = keys
+
+    def forward(self, *tensors):
+        return self.model(dict(zip(self.keys, tensors)))["prediction"]
+
+
+def _tensor_keys(batch):
+    return sorted(key for key, value in batch.items() if torch.is_tensor(value))
+
+
+def export_model(model, sample_batch, path, tolerance=settings.EXPORT_PARITY_TOLERANCE):
+    """
+    Traces the model on sample_batch (encoded input, see
+    model_prediction_affluence.encode_scenarios) and writes a standalone
+    TorchScript file. The trace is only valid for inputs of the same shapes,
+    which are stored alongside. The saved file is reloaded and must match the
+    eager model on sample_batch within tolerance (max absolute difference),
+    otherwise it is discarded. Returns the path, or None if export failed.
+    """
+    keys = _tensor_keys(sample_batch)
+    inputs = tuple(sample_batch[key] for key in keys)
+    shapes = {key: list(sample_batch[key].shape) for key in keys}
+
+    model.eval()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with torch.no_grad():
+            traced = torch.jit.trace(_TensorInputModel(model, keys), inputs, check_trace=False, strict=False)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.jit.save(traced, tmp_path, _extra_files={"inputs.json": json.dumps({"keys": keys, "shapes": shapes})})
+
+        # Parity with the eager model, on what will actually be served
+        with torch.no_grad():
+            eager = model(sample_batch)["prediction"]
+            compiled = torch.jit.load(tmp_path, map_location="cpu")(*inputs)
+        difference = (compiled - eager).abs().max().item()
+        if not difference <= tolerance:
+            raise ValueError(f"traced output differs from the eager model by {difference:.2e} (tolerance {tolerance:.0e})")
+
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        print(f"[WARNING] Model export failed, eager inference will be used: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+class CompiledPredictor:
+    """
+    Lightweight inference on an exported TorchScript model: takes the encoded
+    tensors and returns the quantiles, without pytorch_forecasting's predict
+    machinery (dataloader, Lightning trainer, output wrapping).
+    """
+    def __init__(self, path):
+        extra_files = {"inputs.json": ""}
+        self.module = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+        self.module.eval()
+        spec = json.loads(extra_files["inputs.json"])
+        self.keys = spec["keys"]
+        self.shapes = spec["shapes"]
+
+    def accepts(self, batch):
+        """True if batch has exactly the tensor shapes the model was traced with."""
+        return all(
+            key in batch and torch.is_tensor(batch[key]) and list(batch[key].shape) == shape
+            for key, shape in self.shapes.items()
+        )
+
+    def predict(self, batch):
+        with torch.no_grad():
+            prediction = self.module(*[batch[key] for key in self.keys])
+        return prediction.cpu().numpy()
+
+
+_predictors = OrderedDict()
+_predictors_lock = threading.Lock()
+
+def load_predictor(path, max_loaded=8):
+    """
+    Returns the CompiledPredictor of path (kept in a small LRU), or None if
+    there is no usable exported model.
+    """
+    if not path or not os.path.exists(path):
+        return None
+
+    with _predictors_lock:
+        if path in _predictors:
+            _predictors.move_to_end(path)
+            return _predictors[path]
+
+        try:
+            predictor = CompiledPredictor(path)
+        except Exception as e:
+            print(f"[WARNING] Could not load compiled model {path}: {e}")
+            return None
+
+        _predictors[path] = predictor
+        while len(_predictors) > max_loaded:
+            _predictors.popitem(last=False)
+        return predictor
@@ -1,4 +1,5 @@
 
+import copy
 import os
 import pandas as pd
 import numpy as np
@@ -19,28 +20,66 @@ warnings.filterwarnings("ignore")
 import settings
 import dataset_manager
 import gemini_service
+import holiday_calendar
 
-def train_tft_model(data=None, max_epochs=30, metrics_callback=None):
+class PipelineCancelled(Exception):
+    """Raised when a run is cancelled (client gone) between two steps."""
+    pass
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise PipelineCancelled("Prediction cancelled")
+
+class CancellationCallback(pl.Callback):
+    """Stops trainer.fit at the next batch once cancel_event is set."""
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if self.cancel_event.is_set():
+            trainer.should_stop = True
+
+MAX_PREDICTION_LENGTH = 16
+MAX_ENCODER_LENGTH = 60 # Look back context reduced
+CATEGORICAL_COLUMNS = ["restaurant_id", "day_of_week", "is_holiday", "is_school_vacations"]
+# 0/1 flags, encoded as the "0"/"1" categories (see encode_flag)
+FLAG_COLUMNS = ["is_holiday", "is_school_vacations"]
+
+# Indexes in the QuantileLoss output (quantiles 0.02, 0.1, 0.25, 0.5, 0.75, 0.9, 0.98)
+QUANTILE_LOW = 1
+QUANTILE_MEDIAN = 3
+QUANTILE_HIGH = 5
+
+# "kairoscope" is the data as-is, "no_kairo" the baseline without SIP
+DEFAULT_SCENARIOS = {"kairoscope": {}, "no_kairo": {"sip": 0.0}}
+
+def encode_flag(values):
     """
-    Trains a Temporal Fusion Transformer model on the provided data.
-    metrics_callback: function that accepts a dict (for epoch progress)
+    Category value ("0" or "1") of a flag, whatever its source type: booleans
+    from the database, 0/1 from the holiday calendar, strings, or missing (0).
+    History and future rows must use the same one, or the encoder sees
+    unknown values.
+    """
+    text = pd.Series(values).astype(str).str.strip().str.lower()
+    return text.isin(["1", "1.0", "true"]).astype(int).astype(str)
+
+def prepare_training_data(data, time_origin=None):
+    """
+    Casts the history DataFrame to the types expected by the TimeSeriesDataSet
+    and adds the time_idx column.
+    time_origin: date of time_idx 0 (defaults to the first date of data).
     """
-    
-    # --- 1. Load & Preprocess Data ---
-    if data is None:
-        raise ValueError("Data must be provided as a DataFrame.")
-        
     data["date"] = pd.to_datetime(data["date"])
     
     # Create time_idx
-    min_date = data["date"].min()
+    min_date = pd.Timestamp(time_origin) if time_origin is not None else data["date"].min()
     data["time_idx"] = (data["date"] - min_date).dt.days
     
     # Ensure types are correct
     data["restaurant_id"] = data["restaurant_id"].astype(str)
     data["day_of_week"] = data["day_of_week"].astype(str)
-    data["is_holiday"] = data["is_holiday"].astype(str)
-    data["is_school_vacations"] = data["is_school_vacations"].astype(str)
+    for col in FLAG_COLUMNS:
+        data[col] = encode_flag(data[col])
     
     # Cast to float
     data["affluence"] = data["affluence"].astype(float)
@@ -51,13 +90,89 @@ def train_tft_model(data=None, max_epochs=30, metrics_callback=None):
     # Handle infinite and missing
     data = data.replace([np.inf, -np.inf], np.nan)
     data = data.fillna(0)
+    return data
+
+def restore_training_dataset(dataset_parameters, data, time_origin=None):
+    """
+    Rebuilds the training TimeSeriesDataSet of a stored model from its saved
+    parameters (fitted encoders and normalizers are reused, not refitted).
+    """
+    data = prepare_training_data(data.copy(), time_origin=time_origin)
+    training_cutoff = data["time_idx"].max() - MAX_PREDICTION_LENGTH
+    return TimeSeriesDataSet.from_parameters(dataset_parameters, data[lambda x: x.time_idx <= training_cutoff])
+
+def category_vocabularies(data):
+    """
+    Values taken by each categorical column. A warm start is only possible
+    while these stay the same (the fitted encoders can't map new values).
+    """
+    return {
+        col: sorted((encode_flag(data[col]) if col in FLAG_COLUMNS else data[col].astype(str)).unique().tolist())
+        for col in CATEGORICAL_COLUMNS
+    }
+
+def fine_tune_window(data, since_date):
+    """
+    Rows needed to fine-tune on the days added after since_date: the new days
+    plus one encoder + prediction window before them.
+    """
+    dates = pd.to_datetime(data["date"])
+    start = pd.Timestamp(since_date) - pd.Timedelta(days=MAX_ENCODER_LENGTH + MAX_PREDICTION_LENGTH)
+    return data[dates > start].copy()
+
+def build_training_dataset(data, max_encoder_length=MAX_ENCODER_LENGTH, max_prediction_length=MAX_PREDICTION_LENGTH):
+    """
+    Defines the TimeSeriesDataSet (features, encoders, normalizer) for a fresh model.
+    """
+    return TimeSeriesDataSet(
+        data,
+        time_idx="time_idx",
+        target="affluence",
+        group_ids=["restaurant_id"],
+        min_encoder_length=max_encoder_length // 2,
+        max_encoder_length=max_encoder_length,
+        min_prediction_length=1,
+        max_prediction_length=max_prediction_length,
+        static_categoricals=["restaurant_id"],
+        time_varying_known_categoricals=["day_of_week", "is_holiday", "is_school_vacations"],
+        categorical_encoders={
+            "restaurant_id": NaNLabelEncoder(add_nan=True),
+            "is_holiday": NaNLabelEncoder(add_nan=True),
+            "is_school_vacations": NaNLabelEncoder(add_nan=True),
+        },
+        time_varying_known_reals=["time_idx", "tmax", "prcp", "sip"],
+        time_varying_unknown_reals=["affluence"],
+        target_normalizer=GroupNormalizer(
+            groups=["restaurant_id"], transformation="softplus"
+        ), 
+        add_relative_time_idx=True,
+        add_target_scales=True,
+        add_encoder_length=True,
+        allow_missing_timesteps=True
+    )
+
+def train_tft_model(data=None, max_epochs=30, metrics_callback=None, init_model=None, dataset_parameters=None, time_origin=None, cancel_event=None):
+    """
+    Trains a Temporal Fusion Transformer model on the provided data.
+    metrics_callback: function that accepts a dict (for epoch progress)
+    init_model / dataset_parameters / time_origin: warm start from a previous
+    model, which is fine-tuned with its fitted encoders and normalizers.
+    cancel_event: Event-like object; once set, training stops at the next
+    batch and PipelineCancelled is raised.
+    """
+    
+    # --- 1. Load & Preprocess Data ---
+    if data is None:
+        raise ValueError("Data must be provided as a DataFrame.")
+        
+    data = prepare_training_data(data, time_origin=time_origin)
 
     print(f"Training data range: {data['date'].min()} to {data['date'].max()}")
     
     # --- 2. Define Dataset ---
     
-    max_prediction_length = 16
-    max_encoder_length = 60 # Look back context reduced
+    max_prediction_length = MAX_PREDICTION_LENGTH
+    max_encoder_length = MAX_ENCODER_LENGTH
     training_cutoff = data["time_idx"].max() - max_prediction_length
     
     # Define custom callback for progress
@@ -103,32 +218,16 @@ def train_tft_model(data=None, max_epochs=30, metrics_callback=None):
                 
         callbacks_list.append(WebsocketProgressCallback())
 
-    training = TimeSeriesDataSet(
-        data[lambda x: x.time_idx <= training_cutoff],
-        time_idx="time_idx",
-        target="affluence",
-        group_ids=["restaurant_id"],
-        min_encoder_length=max_encoder_length // 2,
-        max_encoder_length=max_encoder_length,
-        min_prediction_length=1,
-        max_prediction_length=max_prediction_length,
-        static_categoricals=["restaurant_id"],
-        time_varying_known_categoricals=["day_of_week", "is_holiday", "is_school_vacations"],
-        categorical_encoders={
-            "restaurant_id": NaNLabelEncoder(add_nan=True),
-            "is_holiday": NaNLabelEncoder(add_nan=True),
-            "is_school_vacations": NaNLabelEncoder(add_nan=True),
-        },
-        time_varying_known_reals=["time_idx", "tmax", "prcp", "sip"],
-        time_varying_unknown_reals=["affluence"],
-        target_normalizer=GroupNormalizer(
-            groups=["restaurant_id"], transformation="softplus"
-        ), 
-        add_relative_time_idx=True,
-        add_target_scales=True,
-        add_encoder_length=True,
-        allow_missing_timesteps=True
-    )
+    if cancel_event is not None:
+        callbacks_list.append(CancellationCallback(cancel_event))
+
+    if dataset_parameters is not None:
+        # Warm start: reuse the fitted encoders and normalizers of the previous model
+        training = TimeSeriesDataSet.from_parameters(
+            dataset_parameters, data[lambda x: x.time_idx <= training_cutoff]
+        )
+    else:
+        training = build_training_dataset(data[lambda x: x.time_idx <= training_cutoff])
 
     validation = TimeSeriesDataSet.from_dataset(training, data, predict=True, stop_randomization=True)
 
@@ -138,7 +237,8 @@ def train_tft_model(data=None, max_epochs=30, metrics_callback=None):
 
     # --- 3. Define Model ---
     
-    pl.seed_everything(42)
+    if init_model is None:
+        pl.seed_everything(42)
     trainer = pl.Trainer(
         max_epochs=max_epochs,
         accelerator="auto", 
@@ -148,18 +248,25 @@ def train_tft_model(data=None, max_epochs=30, metrics_callback=None):
         callbacks=callbacks_list,
     )
 
-    tft = TemporalFusionTransformer.from_dataset(
-        training,
-        learning_rate=0.03,
-        hidden_size=16,
-        attention_head_size=1,
-        dropout=0.1,
-        hidden_continuous_size=8,
-        output_size=7,
-        loss=QuantileLoss(),
-        log_interval=10,
-        reduce_on_plateau_patience=4,
-    )
+    if init_model is not None:
+        # Continue from the previous weights with a smaller learning rate, on a
+        # copy: init_model is the registry's entry, which a cancelled or failed
+        # fine-tune must leave untouched
+        tft = copy.deepcopy(init_model)
+        tft.hparams.learning_rate = settings.FINE_TUNE_LEARNING_RATE
+    else:
+        tft = TemporalFusionTransformer.from_dataset(
+            training,
+            learning_rate=0.03,
+            hidden_size=16,
+            attention_head_size=1,
+            dropout=0.1,
+            hidden_continuous_size=8,
+            output_size=7,
+            loss=QuantileLoss(),
+            log_interval=10,
+            reduce_on_plateau_patience=4,
+        )
 
     # --- 4. Train ---
     print("Starting Training...")
@@ -169,16 +276,115 @@ def train_tft_model(data=None, max_epochs=30, metrics_callback=None):
         val_dataloaders=val_dataloader,
     )
 
+    # A cancelled run must not produce (or register) a half-trained model
+    check_cancelled(cancel_event)
+
     best_model_path = trainer.checkpoint_callback.best_model_path
     print(f"Best model saved at: {best_model_path}")
     print("Using final model state.")
     return tft, training
 
 
-def predict_future(model, training_dataset, history_df=None, status_callback=None, restaurant_config=None):
+def _scale_real(dataset, column, values):
+    """Applies the fitted scaler of a real column to raw values."""
+    scaler = dataset.scalers.get(column)
+    if scaler is None:
+        return values
+    return np.asarray(scaler.transform(values.reshape(-1, 1)), dtype=float).ravel()
+
+def encode_scenarios(model, data, scenarios):
+    """
+    Encodes the last prediction window of data once and repeats the sample
+    for each scenario, applying its overrides to the future (decoder) part.
+    Returns (batch, names, decoder_length), batch being the model input dict.
+    """
+    dataset = TimeSeriesDataSet.from_parameters(model.dataset_parameters, data, predict=True, stop_randomization=True)
+    x, _ = next(iter(dataset.to_dataloader(train=False, batch_size=1, num_workers=0)))
+
+    names = list(scenarios)
+    decoder_length = int(x["decoder_lengths"][0])
+
+    # Checked before any encoding: one value for every future day, or one per future day
+    overrides = {}
+    for name in names:
+        for column, value in scenarios[name].items():
+            if column not in dataset.reals and column not in dataset.flat_categoricals:
+                raise ValueError(f"Scenario '{name}': unknown covariate '{column}'")
+            values = np.asarray(value).reshape(-1)
+            if len(values) == 1:
+                values = np.repeat(values, decoder_length)
+            elif len(values) != decoder_length:
+                raise ValueError(
+                    f"Scenario '{name}': '{column}' has {len(values)} values, "
+                    f"expected 1 or {decoder_length} (one per future day)"
+                )
+            if column in dataset.flat_categoricals:
+                # Values the encoder never saw would silently become the unknown class
+                values = (encode_flag(values) if column in FLAG_COLUMNS else pd.Series(values).astype(str)).to_numpy()
+                known = sorted(v for v in dataset.categorical_encoders[column].classes_ if v != "nan")
+                unknown = sorted(set(values) - set(known))
+                if unknown:
+                    raise ValueError(f"Scenario '{name}': unknown value(s) {unknown} for '{column}', expected one of {known}")
+            overrides[name, column] = values
+
+    # One copy of the encoded sample per scenario
+    def repeat(value):
+        if isinstance(value, (list, tuple)):
+            return [repeat(v) for v in value]
+        return value.repeat(len(names), *[1] * (value.dim() - 1))
+
+    batch = {key: repeat(value) for key, value in x.items()}
+
+    for i, name in enumerate(names):
+        for column in scenarios[name]:
+            values = overrides[name, column]
+
+            if column in dataset.reals:
+                idx = dataset.reals.index(column)
+                encoded = _scale_real(dataset, column, values.astype(float))
+                batch["decoder_cont"][i, :decoder_length, idx] = torch.as_tensor(encoded, dtype=batch["decoder_cont"].dtype)
+            else:
+                idx = dataset.flat_categoricals.index(column)
+                encoded = dataset.categorical_encoders[column].transform(pd.Series(values))
+                batch["decoder_cat"][i, :decoder_length, idx] = torch.as_tensor(np.asarray(encoded), dtype=batch["decoder_cat"].dtype)
+
+    return batch, names, decoder_length
+
+def predict_scenarios(model, data, scenarios, predictor=None):
+    """
+    Evaluates several what-if scenarios of the same series in one batched
+    forward pass, instead of one model.predict (dataset + dataloader) each.
+    data: context + future rows of one restaurant (as given to model.predict).
+    scenarios: {name: {column: value or one value per future day}}, overrides
+    applied to the future (decoder) part only. {} keeps the data as-is.
+    Raises ValueError if a list of values does not match the future days, or
+    if a categorical value is not known to the model (flags accept 0/1 or
+    booleans).
+    predictor: optional compiled predictor (see model_export), used instead of
+    the eager model when its input shapes match.
+    Returns {name: array [future days, quantiles]}.
+    """
+    batch, names, decoder_length = encode_scenarios(model, data, scenarios)
+
+    prediction = None
+    if predictor is not None and predictor.accepts(batch):
+        prediction = predictor.predict(batch)
+
+    if prediction is None:
+        model.eval()
+        with torch.no_grad():
+            prediction = model(batch)["prediction"].cpu().numpy()
+
+    return {name: prediction[i, :decoder_length] for i, name in enumerate(names)}
+
+def predict_future(model, training_dataset, history_df=None, status_callback=None, restaurant_config=None, scenarios=None, predictor=None, cancel_event=None):
     """
     Uses the trained model to predict the next 16 days.
     Fetches future features via Gemini/Weather.
+    scenarios: optional extra what-if scenarios (see predict_scenarios), added
+    to the results as predicted_affluence_<name>, conf_low_<name>, conf_high_<name>.
+    predictor: optional compiled predictor (see model_export).
+    cancel_event: once set, the Gemini/weather fetches are skipped (PipelineCancelled).
     """
     # 1. Load History
     if history_df is None:
@@ -193,6 +399,7 @@ def predict_future(model, training_dataset, history_df=None, status_callback=Non
     start_future = (last_date + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
     end_future = (last_date + pd.Timedelta(days=16)).strftime("%Y-%m-%d")
     
+    check_cancelled(cancel_event)
     print(f"Fetching future data from {start_future} to {end_future}...")
     
     if status_callback:
@@ -207,7 +414,14 @@ def predict_future(model, training_dataset, history_df=None, status_callback=Non
         # This prevents hard crash but might lead to poor results if defaults aren't enough
         restaurant_config = {"latitude": 46.7833, "longitude": 4.85}
 
-    future_list = gemini_service.get_future_data(date_debut=start_future, date_fin=end_future, restaurant_config=restaurant_config)
+    def on_day(date_str, events):
+        # Each day's events reach the client as soon as they are known
+        if status_callback:
+            status_callback({"status": "events", "date": date_str, "events": events})
+
+    future_list = gemini_service.get_future_data(
+        date_debut=start_future, date_fin=end_future, restaurant_config=restaurant_config, on_day=on_day
+    )
 
     if not future_list:
         print("[ERROR] No future data returned.")
@@ -237,13 +451,13 @@ def predict_future(model, training_dataset, history_df=None, status_callback=Non
     future_df["day_of_week"] = future_df["day_of_week"].map(day_map).fillna(future_df["day_of_week"])
     
     # New Service might return SIP directly, but we need is_holiday etc.
-    # For now we assume defaults for future if not explicitly returned in the simple list
-    future_df["is_holiday"] = 0 
+    # Holidays are known in advance; the others default if not explicitly returned in the simple list
+    future_df["is_holiday"] = holiday_calendar.is_holiday(future_df["date"])
     future_df["is_school_vacations"] = 0
     future_df["prcp"] = 0.0
     
-    future_df["is_holiday"] = future_df["is_holiday"].astype(int).astype(str)
-    future_df["is_school_vacations"] = future_df["is_school_vacations"].astype(int).astype(str)
+    for col in FLAG_COLUMNS:
+        future_df[col] = encode_flag(future_df[col])
     future_df["day_of_week"] = future_df["day_of_week"].astype(str)
     
     future_df["affluence"] = future_df["affluence"].astype(float)
@@ -255,8 +469,8 @@ def predict_future(model, training_dataset, history_df=None, status_callback=Non
     context_df = history.tail(400).copy()
     context_df["restaurant_id"] = context_df["restaurant_id"].astype(str)
     context_df["day_of_week"] = context_df["day_of_week"].astype(str)
-    context_df["is_holiday"] = context_df["is_holiday"].astype(str)
-    context_df["is_school_vacations"] = context_df["is_school_vacations"].astype(str)
+    for col in FLAG_COLUMNS:
+        context_df[col] = encode_flag(context_df[col])
     context_df["time_idx"] = (context_df["date"] - min_date).dt.days
     
     cols = ["time_idx", "date", "restaurant_id", "day_of_week", "is_holiday", 
@@ -266,36 +480,23 @@ def predict_future(model, training_dataset, history_df=None, status_callback=Non
     combined = combined.sort_values(["restaurant_id", "date"]).reset_index(drop=True)
     combined["time_idx"] = range(len(combined))
     
-    # --- 5. Predict (Standard Kairoscope) ---
-    print("Generating predictions (Kairoscope)...")
-    
-    new_prediction_data = combined
-    raw_predictions = model.predict(new_prediction_data, mode="raw", return_x=True)
-    
-    preds = raw_predictions.output.prediction[0] 
-    median_preds = preds[:, 3].detach().cpu().numpy()
-    lower_preds = preds[:, 1].detach().cpu().numpy()
-    upper_preds = preds[:, 5].detach().cpu().numpy()
+    # --- 5. Predict all scenarios in one forward pass ---
+    all_scenarios = dict(DEFAULT_SCENARIOS)
+    all_scenarios.update(scenarios or {})
+    print(f"Generating predictions ({', '.join(all_scenarios)})...")
 
-    # --- 6. Predict (Non-Kairoscope / Baseline) ---
-    print("Generating predictions (Non-Kairoscope)...")
-    
-    # Create baseline future data with SIP=0
-    future_df_no_kairo = future_df.copy()
-    future_df_no_kairo["sip"] = 0.0
-    
-    # Merge for baseline
-    combined_no_kairo = pd.concat([context_df[cols], future_df_no_kairo[cols]], ignore_index=True)
-    combined_no_kairo = combined_no_kairo.sort_values(["restaurant_id", "date"]).reset_index(drop=True)
-    combined_no_kairo["time_idx"] = range(len(combined_no_kairo))
+    scenario_preds = predict_scenarios(model, combined, all_scenarios, predictor=predictor)
     
-    # Predict baseline
-    raw_predictions_no_kairo = model.predict(combined_no_kairo, mode="raw", return_x=True)
-    preds_no_kairo = raw_predictions_no_kairo.output.prediction[0]
-    
-    median_preds_no_kairo = preds_no_kairo[:, 3].detach().cpu().numpy()
-    lower_preds_no_kairo = preds_no_kairo[:, 1].detach().cpu().numpy()
-    upper_preds_no_kairo = preds_no_kairo[:, 5].detach().cpu().numpy()
+    preds = scenario_preds["kairoscope"]
+    median_preds = preds[:, QUANTILE_MEDIAN]
+    lower_preds = preds[:, QUANTILE_LOW]
+    upper_preds = preds[:, QUANTILE_HIGH]
+
+    # --- 6. Non-Kairoscope / Baseline ---
+    preds_no_kairo = scenario_preds["no_kairo"]
+    median_preds_no_kairo = preds_no_kairo[:, QUANTILE_MEDIAN]
+    lower_preds_no_kairo = preds_no_kairo[:, QUANTILE_LOW]
+    upper_preds_no_kairo = preds_no_kairo[:, QUANTILE_HIGH]
     
     # --- 7. Compile Results ---
     results_df = future_df[["date", "day_of_week", "tmax", "sip"]].copy()
@@ -315,8 +516,16 @@ def predict_future(model, training_dataset, history_df=None, status_callback=Non
     results_df["conf_low_no_kairo"] = lower_preds_no_kairo
     results_df["conf_high_no_kairo"] = upper_preds_no_kairo
     
+    # Additional what-if scenarios
+    clipped_cols = ["predicted_affluence", "conf_low", "conf_high", "predicted_affluence_no_kairo", "conf_low_no_kairo", "conf_high_no_kairo"]
+    for name in scenarios or {}:
+        results_df[f"predicted_affluence_{name}"] = scenario_preds[name][:, QUANTILE_MEDIAN]
+        results_df[f"conf_low_{name}"] = scenario_preds[name][:, QUANTILE_LOW]
+        results_df[f"conf_high_{name}"] = scenario_preds[name][:, QUANTILE_HIGH]
+        clipped_cols += [f"predicted_affluence_{name}", f"conf_low_{name}", f"conf_high_{name}"]
+    
     # Clip to max_covers
-    for col in ["predicted_affluence", "conf_low", "conf_high", "predicted_affluence_no_kairo", "conf_low_no_kairo", "conf_high_no_kairo"]:
+    for col in clipped_cols:
         results_df[col] = results_df[col].clip(lower=0, upper=max_covers)
     
     
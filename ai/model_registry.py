@@ -0,0 +1,198 @@
+import os
+import glob
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+import torch
+import settings
+
+# Columns coming straight from historique_affluence that the model is trained on.
+# The SIP columns are left out on purpose: add_sip_features draws random local
+# events, so hashing them would give a new fingerprint on every load.
+FINGERPRINT_COLUMNS = [
+    "date", "restaurant_id", "day_of_week", "is_holiday", "is_school_vacations",
+    "tmax", "prcp", "affluence"
+]
+
+
+def history_fingerprint(df):
+    """
+    Returns a short fingerprint of a training history:
+    row count + last date + hash of the content.
+    """
+    if df is None or df.empty:
+        return "empty"
+
+    columns = [c for c in FINGERPRINT_COLUMNS if c in df.columns]
+    content = df[columns].copy()
+    content["date"] = pd.to_datetime(content["date"])
+    content_hash = hashlib.sha256(
+        pd.util.hash_pandas_object(content, index=False).values.tobytes()
+    ).hexdigest()
+
+    last_date = content["date"].max().strftime("%Y%m%d")
+    return f"{len(content)}-{last_date}-{content_hash[:16]}"
+
+
+class ModelRegistry:
+    """
+    Stores fitted TemporalFusionTransformer models keyed by restaurant_id and
+    history fingerprint.
+    - In memory: LRU limited to `memory_size` models.
+    - On disk: one file per model, oldest files removed above `max_disk_mb`.
+    """
+    def __init__(self, directory=settings.MODEL_REGISTRY_DIR,
+                 memory_size=settings.MODEL_REGISTRY_MEMORY_SIZE,
+                 max_disk_mb=settings.MODEL_REGISTRY_MAX_DISK_MB):
+        self.directory = directory
+        self.memory_size = memory_size
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, restaurant_id, fingerprint):
+        return os.path.join(self.directory, f"restaurant_{restaurant_id}_{fingerprint}.pt")
+
+    def compiled_path(self, restaurant_id, fingerprint):
+        """Where the exported TorchScript version of a model lives (see model_export)."""
+        return os.path.join(self.directory, f"restaurant_{restaurant_id}_{fingerprint}.ts")
+
+    def get(self, restaurant_id, fingerprint):
+        """
+        Returns the stored entry (dict with 'model' and 'dataset_parameters')
+        or None if no model was trained on this exact history.
+        """
+        key = (str(restaurant_id), fingerprint)
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            path = self._path(restaurant_id, fingerprint)
+            if not os.path.exists(path):
+                return None
+
+            try:
+                entry = torch.load(path, map_location="cpu", weights_only=False)
+            except Exception as e:
+                print(f"[WARNING] Could not load model {path}: {e}")
+                return None
+
+            # Touch the file so disk eviction keeps recently used models
+            os.utime(path, None)
+            self._remember(key, entry)
+            return entry
+
+    def latest(self, restaurant_id):
+        """
+        Returns the most recent entry of the restaurant whatever its fingerprint
+        (starting point for incremental fine-tuning), or None.
+        The newest file on disk wins over the in-memory copy, so a model saved
+        by another process (e.g. the nightly scheduler) is picked up.
+        """
+        with self._lock:
+            paths = glob.glob(self._path(restaurant_id, "*"))
+            if not paths:
+                for key in reversed(self._memory):
+                    if key[0] == str(restaurant_id):
+                        return self._memory[key]
+                return None
+            path = max(paths, key=os.path.getmtime)
+
+            fingerprint = os.path.basename(path)[len(f"restaurant_{restaurant_id}_"):-len(".pt")]
+            key = (str(restaurant_id), fingerprint)
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            try:
+                entry = torch.load(path, map_location="cpu", weights_only=False)
+            except Exception as e:
+                print(f"[WARNING] Could not load model {path}: {e}")
+                return None
+
+            # Older copies of the restaurant are outdated
+            for old_key in [k for k in self._memory if k[0] == key[0]]:
+                del self._memory[old_key]
+            self._remember((str(restaurant_id), entry["fingerprint"]), entry)
+            return entry
+
+    def put(self, restaurant_id, fingerprint, model, training_dataset, **metadata):
+        """
+        Saves a freshly trained model and its dataset parameters.
+        Extra keyword arguments are stored as-is in the entry (training metadata).
+        Older models of the same restaurant are dropped (their history is outdated).
+        """
+        key = (str(restaurant_id), fingerprint)
+        entry = {
+            "restaurant_id": str(restaurant_id),
+            "fingerprint": fingerprint,
+            "model": model,
+            "dataset_parameters": training_dataset.get_parameters(),
+            "saved_at": time.time(),
+            **metadata,
+        }
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(restaurant_id, fingerprint)
+
+            # Write to a temp file first so concurrent readers never see a partial file
+            # (unique per process: server workers and the scheduler may save at once)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(entry, tmp_path)
+            os.replace(tmp_path, path)
+
+            # Only now drop the older models: a reader always finds one
+            for old_path in glob.glob(self._path(restaurant_id, "*")):
+                if old_path != path:
+                    self._remove(old_path)
+            for old_key in [k for k in self._memory if k[0] == key[0] and k != key]:
+                del self._memory[old_key]
+
+            self._remember(key, entry)
+            self._evict_disk()
+
+        return entry
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.pt")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size = stat.st_size
+            compiled = f"{os.path.splitext(path)[0]}.ts"
+            if os.path.exists(compiled):
+                size += os.path.getsize(compiled)
+            files.append((stat.st_mtime, size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+
+        # Always keep the most recent file, even if it is bigger than the cap
+        while total > self.max_disk_bytes and len(files) > 1:
+            _, size, oldest = files.pop(0)
+            total -= size
+            self._remove(oldest)
+            print(f"Model registry: evicted {os.path.basename(oldest)}")
+
+    def _remove(self, path):
+        # A model goes with its compiled version, if any
+        for p in (path, f"{os.path.splitext(path)[0]}.ts"):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+# Singleton
+registry = ModelRegistry()
@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import time
+from datetime import datetime, timedelta
+import settings
+
+
+class PredictionCache:
+    """
+    Final forecast payloads stored on disk, keyed by restaurant_id and forecast
+    start date. Entries older than the TTL are still served but reported as
+    stale so the caller can refresh them in the background.
+    Storing a forecast removes the restaurant's entries of earlier start dates.
+    Disk access is blocking: call it from a thread in async code.
+    """
+    def __init__(self, directory=settings.PREDICTION_CACHE_DIR, ttl_hours=settings.PREDICTION_CACHE_TTL_HOURS):
+        self.directory = directory
+        self.ttl_seconds = ttl_hours * 3600
+
+    def _path(self, restaurant_id, forecast_start):
+        return os.path.join(self.directory, f"restaurant_{restaurant_id}_{forecast_start}.json")
+
+    def get(self, restaurant_id, forecast_start):
+        """Returns the cached entry or None."""
+        path = self._path(restaurant_id, forecast_start)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[WARNING] Unreadable prediction cache entry {path}: {e}")
+            return None
+
+    def is_fresh(self, entry):
+        return time.time() - entry["created_at"] < self.ttl_seconds
+
+    def put(self, restaurant_id, forecast_start, payload):
+        entry = {
+            "restaurant_id": str(restaurant_id),
+            "forecast_start": forecast_start,
+            "created_at": time.time(),
+            "payload": payload,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(restaurant_id, forecast_start)
+
+        # Atomic replace: several worker processes may write the same entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+        # Forecasts of earlier start dates will never be asked for again
+        for old_path in glob.glob(self._path(restaurant_id, "*")):
+            if old_path.endswith(".json") and old_path < path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+        return entry
+
+
+def forecast_start_for(restaurant_id):
+    """
+    Forecast start date (YYYY-MM-DD) of the next prediction: the day after the
+    last history row. None if it cannot be determined.
+    """
+    import database_service
+    last_date = database_service.service.get_last_history_date(restaurant_id)
+    if last_date is None:
+        return None
+    if isinstance(last_date, datetime):
+        last_date = last_date.date()
+    return (last_date + timedelta(days=1)).strftime("%Y-%m-%d")
+
+# Singleton
+cache = PredictionCache()
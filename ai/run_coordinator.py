@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+from execution_backend import executor as default_executor
+from admission import AdmissionController, AdmissionRejected, queued_message
+from metrics import metrics
+
+
+def run_fingerprint(**inputs):
+    """Short hash of the pipeline inputs, so different parameters never share a run."""
+    raw = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+class PredictionRun:
+    """One in-flight pipeline run and the websocket clients listening to it."""
+    def __init__(self, key, background=False):
+        self.key = key
+        self.history = []
+        self.subscribers = set()
+        self.done = False
+        self.task = None
+        self.ticket = None
+        # Created once the run is admitted (see RunCoordinator._drive)
+        self.cancel_event = None
+        self.cancelled = False
+        # Background refreshes keep running without subscribers
+        self.background = background
+
+    def publish(self, msg):
+        if msg is not None:
+            self.history.append(msg)
+        for queue in self.subscribers:
+            queue.put_nowait(msg)
+
+    def replay(self):
+        """
+        Messages a late subscriber missed. Only the latest 'steps' and 'queued'
+        messages are kept: the client needs the current epoch or queue
+        position, not every previous one.
+        """
+        latest = {}
+        for msg in self.history:
+            if msg.get("status") in ("steps", "queued"):
+                latest[msg["status"]] = msg
+        return [msg for msg in self.history if msg.get("status") not in latest or msg is latest[msg["status"]]]
+
+    def on_queued(self, position, queue_length, wait_seconds):
+        self.publish(queued_message(position, queue_length, wait_seconds))
+
+
+class RunCoordinator:
+    """
+    Single-flight deduplication of prediction runs.
+    Clients asking for the same restaurant with the same inputs attach to the
+    run already in progress instead of starting a new one.
+    New runs go through admission control (see admission.py): they wait for
+    a slot in a bounded queue, or are rejected when it is full.
+    """
+    def __init__(self, executor=default_executor, admission=None):
+        self.executor = executor
+        self.admission = admission or AdmissionController()
+        self._runs = {}
+
+    def _start(self, key, restaurant_id, epochs, background=False):
+        run = PredictionRun(key, background)
+        try:
+            run.ticket = self.admission.enter(on_queued=run.on_queued)
+        except AdmissionRejected:
+            metrics.increment("pipeline_runs_rejected")
+            raise
+        self._runs[key] = run
+        run.task = asyncio.create_task(self._drive(run, restaurant_id, epochs))
+        metrics.increment("pipeline_runs_started")
+        self._update_gauges()
+        return run
+
+    def _update_gauges(self):
+        metrics.set_gauge("pipelines_running", self.admission.running)
+        metrics.set_gauge("pipelines_queued", self.admission.queued)
+
+    async def _drive(self, run, restaurant_id, epochs):
+        outcome = "completed"
+        try:
+            await run.ticket.granted
+            # Queue positions are meaningless to clients joining a started run
+            run.history = [msg for msg in run.history if msg.get("status") != "queued"]
+            self._update_gauges()
+
+            # Manager calls are blocking IPC: keep them off the event loop
+            run.cancel_event = await asyncio.to_thread(self.executor.new_cancel_event)
+            if run.cancelled:
+                # The last client left while the event was being created
+                outcome = "cancelled"
+                return
+
+            async for msg in self.executor.stream(epochs=epochs, restaurant_id=restaurant_id, cancel_event=run.cancel_event):
+                if msg.get("status") == "error":
+                    outcome = "failed"
+                elif msg.get("status") == "cancelled":
+                    outcome = "cancelled"
+                run.publish(msg)
+        except asyncio.CancelledError:
+            # Cancelled while still queued (see _cancel)
+            outcome = "cancelled"
+        except Exception as e:
+            outcome = "failed"
+            run.publish({"status": "error", "message": str(e)})
+        finally:
+            self.admission.leave(run.ticket, completed=outcome == "completed")
+            self._update_gauges()
+            metrics.increment(f"pipeline_runs_{outcome}")
+            run.done = True
+            run.publish(None)
+            if self._runs.get(run.key) is run:
+                del self._runs[run.key]
+
+    def _cancel(self, run):
+        """Nobody listens any more: stop the worker at its next step."""
+        print(f"No client left for run {run.key}, cancelling.")
+        run.cancelled = True
+        if run.cancel_event is not None:
+            # Blocking IPC to the manager process: done off the event loop
+            asyncio.get_running_loop().run_in_executor(None, run.cancel_event.set)
+        if not run.ticket.running:
+            # Still queued: give the place back right away
+            self.admission.leave(run.ticket)
+            self._update_gauges()
+            run.task.cancel()
+        # New clients must not attach to a run that is stopping
+        if self._runs.get(run.key) is run:
+            del self._runs[run.key]
+
+    def refresh(self, restaurant_id, epochs=30):
+        """Starts a run without any subscriber (background refresh), unless one is already in flight."""
+        key = (restaurant_id, run_fingerprint(epochs=epochs))
+        if key not in self._runs:
+            print(f"Background refresh of the forecast for restaurant {restaurant_id}.")
+            try:
+                self._start(key, restaurant_id, epochs, background=True)
+            except AdmissionRejected:
+                print(f"Server busy, background refresh of restaurant {restaurant_id} skipped.")
+
+    async def subscribe(self, restaurant_id, epochs=30):
+        """
+        Async generator yielding the status dicts of the (possibly shared) run.
+        Late subscribers first receive the messages they missed.
+        Raises AdmissionRejected if a new run is needed and the queue is full.
+        """
+        key = (restaurant_id, run_fingerprint(epochs=epochs))
+        run = self._runs.get(key)
+
+        if run is None:
+            run = self._start(key, restaurant_id, epochs)
+        else:
+            print(f"Joining in-flight prediction for restaurant {restaurant_id} ({len(run.subscribers)} already listening).")
+            metrics.increment("pipeline_runs_joined")
+
+        queue = asyncio.Queue()
+        for msg in run.replay():
+            queue.put_nowait(msg)
+
+        if run.done:
+            queue.put_nowait(None)
+        else:
+            run.subscribers.add(queue)
+
+        try:
+            while True:
+                msg = await queue.get()
+                if msg is None:
+                    break
+                yield msg
+        finally:
+            # Reached on normal end and when the consumer is cancelled (client disconnected)
+            run.subscribers.discard(queue)
+            if not run.subscribers and not run.done and not run.background:
+                self._cancel(run)
+
+# Singleton
+coordinator = RunCoordinator()
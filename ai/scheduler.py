@@ -0,0 +1,231 @@
+import argparse
+import multiprocessing
+import os
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+# Suppress TensorFlow INFO/WARNING logs
+os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+
+# Suppress generic warnings
+warnings.filterwarnings("ignore")
+
+import settings
+from execution_backend import _init_worker
+
+
+def _precompute(restaurant_id, epochs, training_mode):
+    """
+    Runs inside a worker process: training + predict_future for one restaurant.
+    The forecast itself is persisted by the pipeline (see prediction_cache).
+    """
+    import main
+    messages = []
+    main.execute_pipeline(epochs, restaurant_id, messages.append, training_mode=training_mode)
+
+    errors = [m["message"] for m in messages if m and m.get("status") == "error"]
+    if errors:
+        return {"ok": False, "message": errors[-1]}
+    if not any(m and m.get("status") == "output" for m in messages):
+        return {"ok": False, "message": "No forecast produced"}
+    return {"ok": True, "message": "Forecast stored"}
+
+
+def _train_global(epochs, restaurant_ids):
+    """Runs inside a worker process: trains the fleet model once before the batch."""
+    import main
+    started = time.time()
+    main.train_global_model(epochs, restaurant_ids, on_progress=lambda msg: None)
+    return time.time() - started
+
+
+def warm_weather_forecasts(restaurant_ids):
+    """Fetches the weather forecasts of the whole fleet in a few multi-location requests."""
+    import database_service
+    import weather_forecast
+
+    coordinates = []
+    for restaurant_id in restaurant_ids:
+        config = database_service.service.get_restaurant_config(restaurant_id)
+        if config:
+            coordinates.append((config["latitude"], config["longitude"]))
+
+    fetched = weather_forecast.store.warm(coordinates)
+    print(f"Weather forecasts: {fetched} grid cells fetched for {len(coordinates)} restaurants.")
+
+
+def _parse_hour(value):
+    hour, minute = value.split(":")
+    return int(hour), int(minute)
+
+
+def next_window(start, end, now=None):
+    """
+    Returns (window_start, window_end) datetimes of the current or next window.
+    A window ending before it starts (e.g. 23:00 -> 05:00) crosses midnight.
+    """
+    now = now or datetime.now()
+    start_h, start_m = _parse_hour(start)
+    end_h, end_m = _parse_hour(end)
+
+    window_start = now.replace(hour=start_h, minute=start_m, second=0, microsecond=0)
+    window_end = now.replace(hour=end_h, minute=end_m, second=0, microsecond=0)
+    if window_end <= window_start:
+        window_end += timedelta(days=1)
+
+    # Still inside yesterday's window (only possible when it crosses midnight)
+    if window_start - timedelta(days=1) <= now < window_end - timedelta(days=1):
+        return window_start - timedelta(days=1), window_end - timedelta(days=1)
+
+    if now >= window_end:
+        window_start += timedelta(days=1)
+        window_end += timedelta(days=1)
+    return window_start, window_end
+
+
+def _new_pool(concurrency):
+    # "spawn" avoids forking a process that may already hold torch threads
+    context = multiprocessing.get_context("spawn")
+    threads_per_worker = max(1, (os.cpu_count() or 1) // concurrency)
+    return ProcessPoolExecutor(
+        max_workers=concurrency,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(threads_per_worker,)
+    )
+
+
+def run_batch(restaurant_ids, epochs=30, concurrency=settings.PRECOMPUTE_CONCURRENCY,
+              retries=settings.PRECOMPUTE_RETRIES, deadline=None):
+    """
+    Precomputes the forecast of every restaurant on a pool of `concurrency`
+    workers. Failed restaurants are retried up to `retries` times. No new run
+    is started after `deadline` (datetime), runs already started are finished.
+    Returns a report dict: restaurant_id -> {ok, attempts, seconds, message}.
+    """
+    pending = deque((restaurant_id, 1) for restaurant_id in restaurant_ids)
+    running = {}
+    report = {}
+    pool = _new_pool(concurrency)
+    training_mode = settings.TRAINING_MODE
+
+    print(f"--- Precomputing {len(pending)} restaurants ({concurrency} workers) ---")
+
+    try:
+        if training_mode == "global":
+            # One shared model: train it once, then every restaurant only predicts
+            try:
+                elapsed = pool.submit(_train_global, epochs, settings.GLOBAL_RESTAURANT_IDS).result()
+                print(f"[OK] Global model trained in {elapsed:.1f}s")
+            except Exception as e:
+                # Workers must not each retrain the fleet model: fall back to one model per restaurant
+                print(f"[ERROR] Global model training failed: {e} - running the batch in per-restaurant mode")
+                training_mode = "restaurant"
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _new_pool(concurrency)
+
+        while pending or running:
+            while pending and len(running) < concurrency and (deadline is None or datetime.now() < deadline):
+                restaurant_id, attempt = pending.popleft()
+                future = pool.submit(_precompute, restaurant_id, epochs, training_mode)
+                running[future] = (restaurant_id, attempt, time.time())
+
+            if not running:
+                break # Window closed
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+
+            for future in done:
+                restaurant_id, attempt, started = running.pop(future)
+                elapsed = time.time() - started
+
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    result = {"ok": False, "message": f"Worker crashed: {e}"}
+                except Exception as e:
+                    result = {"ok": False, "message": str(e)}
+
+                if result["ok"]:
+                    print(f"[OK] Restaurant {restaurant_id}: {elapsed:.1f}s (attempt {attempt})")
+                elif attempt <= retries:
+                    print(f"[WARNING] Restaurant {restaurant_id} failed after {elapsed:.1f}s: {result['message']} - retrying")
+                    pending.append((restaurant_id, attempt + 1))
+                else:
+                    print(f"[ERROR] Restaurant {restaurant_id} failed after {attempt} attempts: {result['message']}")
+
+                report[restaurant_id] = {
+                    "ok": result["ok"],
+                    "attempts": attempt,
+                    "seconds": round(elapsed, 1),
+                    "message": result["message"]
+                }
+
+            if broken:
+                # A dead worker breaks the whole pool: requeue what was running and start a new one
+                for restaurant_id, attempt, _ in running.values():
+                    pending.appendleft((restaurant_id, attempt))
+                running = {}
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _new_pool(concurrency)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    for restaurant_id, _ in pending:
+        print(f"[WARNING] Restaurant {restaurant_id} skipped: precompute window closed.")
+        report.setdefault(restaurant_id, {"ok": False, "attempts": 0, "seconds": 0.0, "message": "Window closed"})
+
+    succeeded = sum(1 for r in report.values() if r["ok"])
+    print(f"--- Precompute done: {succeeded}/{len(report)} restaurants ---")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kairoscope nightly forecast precompute")
+    parser.add_argument("--epochs", type=int, default=30, help="Number of training epochs")
+    parser.add_argument("--restaurant_ids", type=int, nargs="*", help="Restrict to these restaurants (default: all)")
+    parser.add_argument("--window_start", type=str, default=settings.PRECOMPUTE_WINDOW_START, help="Window start (HH:MM)")
+    parser.add_argument("--window_end", type=str, default=settings.PRECOMPUTE_WINDOW_END, help="Window end (HH:MM)")
+    parser.add_argument("--concurrency", type=int, default=settings.PRECOMPUTE_CONCURRENCY, help="Restaurants processed in parallel")
+    parser.add_argument("--retries", type=int, default=settings.PRECOMPUTE_RETRIES, help="Retries per failed restaurant")
+    parser.add_argument("--now", action="store_true", help="Run once immediately, ignoring the window")
+    parser.add_argument("--daemon", action="store_true", help="Keep running, one batch per window")
+    args = parser.parse_args()
+
+    import database_service
+
+    while True:
+        deadline = None
+        if not args.now:
+            window_start, deadline = next_window(args.window_start, args.window_end)
+            wait_seconds = (window_start - datetime.now()).total_seconds()
+            if wait_seconds > 0:
+                print(f"Next precompute window: {window_start} -> {deadline}")
+                time.sleep(wait_seconds)
+
+        restaurant_ids = args.restaurant_ids or database_service.service.list_restaurant_ids()
+        warm_weather_forecasts(restaurant_ids)
+        run_batch(
+            restaurant_ids,
+            epochs=args.epochs,
+            concurrency=args.concurrency,
+            retries=args.retries,
+            deadline=deadline
+        )
+
+        if not args.daemon:
+            break
+        # Next loop waits for the next window
+        args.now = False
+        if deadline is not None and datetime.now() < deadline:
+            time.sleep((deadline - datetime.now()).total_seconds())
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import uvicorn
 import json
 import sys
@@ -9,8 +10,14 @@ import asyncio
 # Ensure the current directory is in the python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Import the pipeline generator
-from main import run_prediction_pipeline
+# Pool of worker processes running the prediction pipeline
+from execution_backend import executor
+# Shares one pipeline run between clients asking for the same restaurant
+from run_coordinator import coordinator
+from admission import AdmissionRejected
+# Final forecasts kept for the next viewers
+import prediction_cache
+from metrics import metrics
 
 app = FastAPI()
 
@@ -22,6 +29,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Heavy modules (torch, lightning, pytorch_forecasting, Gemini SDK) are never
+# imported by this process: they are preloaded in the workers once the server is up.
+@app.on_event("startup")
+async def warm_up():
+    # Starting the manager and the workers blocks: done off the event loop
+    asyncio.get_running_loop().run_in_executor(None, executor.warm_up)
+    # DB driver + pandas, needed by the cache lookup of the first request
+    asyncio.get_running_loop().run_in_executor(None, __import__, "database_service")
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once every worker has loaded the ML stack, 503 before."""
+    state = executor.readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Pipeline counters (started, completed, failed, cancelled, joined, rejected runs...)
+    and queue gauges, plus the aggregated metrics of the worker processes (DB pool usage).
+    """
+    snapshot = metrics.snapshot()
+    # Pipelines (and their database connections) run in the worker processes
+    snapshot["workers"] = executor.worker_metrics()
+    return snapshot
+
+async def wait_for_disconnect(websocket):
+    """Returns as soon as the client closes the connection (client messages are ignored)."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
 # ws://localhost:8000/ws/predict?restaurantId=1
 # ws://localhost:8000/ws/predict?restaurantId=1
 @app.websocket("/ws/predict")
@@ -36,39 +76,83 @@ async def websocket_endpoint(websocket: WebSocket, restaurantId: int):
     
     await websocket.accept()
     print("Websocket client connected.")
+    disconnected = False
     
     try:
-        # NOTE: run_prediction_pipeline contains blocking code (training).
-        # In a production async environment, we would run valid blocking
-        # code in a threadpool, but for this 'basic structure', we iterate directly.
-        # This means the server won't respond to *other* requests during heavy computation steps,
-        # but it will yield messages between steps.
+        # Training and prediction run in a worker process (see execution_backend),
+        # the event loop only relays the progress messages.
+        # Concurrent clients of the same restaurant share a single run (see run_coordinator).
         
         # Optionally wait for a start message or configuration
         # data = await websocket.receive_text() 
         
         epochs = 30 # Default or could be parsed from initial message
+
+        # Serve the cached forecast if there is one (refreshed in background when stale)
+        forecast_start = await asyncio.to_thread(prediction_cache.forecast_start_for, restaurantId)
+        entry = await asyncio.to_thread(prediction_cache.cache.get, restaurantId, forecast_start) if forecast_start else None
+
+        if entry is not None:
+            state = "hit" if prediction_cache.cache.is_fresh(entry) else "stale"
+            await websocket.send_json({"status": "cache", "cache": state, "created_at": entry["created_at"]})
+            await websocket.send_json({"status": "output", "payload": entry["payload"], "cache": state})
+            if state == "stale":
+                coordinator.refresh(restaurant_id=restaurantId, epochs=epochs)
+            return
+
+        await websocket.send_json({"status": "cache", "cache": "miss"})
         
-        # Iterate through the pipeline steps
-        for step in run_prediction_pipeline(epochs=epochs, restaurant_id=restaurantId):
-            # Handle heartbeat (empty queue) from generator
-            if step is None:
-                await asyncio.sleep(0.1)
-                continue
-
-            # Send each step as a JSON message to the frontend
-            await websocket.send_json(step)
-            
-            # Small sleep to ensure the event loop yields (helps with stability)
-            await asyncio.sleep(0.01)
+        async def relay():
+            # Iterate through the pipeline steps
+            async for step in coordinator.subscribe(restaurant_id=restaurantId, epochs=epochs):
+                # Send each step as a JSON message to the frontend
+                await websocket.send_json(step)
+
+        # Watch for a disconnect while relaying: leaving the subscription
+        # cancels the run if no other client is waiting for it.
+        relay_task = asyncio.create_task(relay())
+        disconnect_task = asyncio.create_task(wait_for_disconnect(websocket))
+        done, pending = await asyncio.wait({relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        if disconnect_task in done:
+            disconnected = True
+            print("Websocket client disconnected before the end of the prediction.")
+        else:
+            relay_task.result()
+
+    except AdmissionRejected as e:
+        # Queue full: tell the client when to come back instead of holding the connection
+        print(f"Prediction rejected for restaurant {restaurantId}: {e}")
+        try:
+            await websocket.send_json({"status": "rejected", "message": str(e), "retry_after": e.retry_after})
+            await websocket.close(code=1013)  # Try Again Later
+        except Exception:
+            pass
+        disconnected = True
             
     except Exception as e:
         print(f"Error in websocket loop: {e}")
-        await websocket.send_json({"type": "error", "message": str(e)})
+        if not disconnected:
+            try:
+                await websocket.send_json({"type": "error", "message": str(e)})
+            except Exception:
+                disconnected = True
         
     finally:
         print("Websocket connection closed.")
-        await websocket.close()
+        if not disconnected:
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    executor.shutdown()
 
 if __name__ == "__main__":
     # Run the server
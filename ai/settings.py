@@ -13,6 +13,81 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # API Keys
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
+# Database connection pool (database_service.py, one pool per process)
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "10"))  # wait for a free connection
+DB_POOL_HEALTH_CHECK_SECONDS = float(os.environ.get("DB_POOL_HEALTH_CHECK_SECONDS", "30"))  # idle connections are checked after
+
+# Model Registry (trained TFT models reused across predictions)
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join(BASE_DIR, "model_registry"))
+MODEL_REGISTRY_MEMORY_SIZE = int(os.environ.get("MODEL_REGISTRY_MEMORY_SIZE", "8"))  # models kept in RAM (LRU)
+MODEL_REGISTRY_MAX_DISK_MB = int(os.environ.get("MODEL_REGISTRY_MAX_DISK_MB", "512"))  # on-disk cap
+
+# Export trained models to TorchScript for lighter CPU inference
+EXPORT_COMPILED_MODELS = os.environ.get("EXPORT_COMPILED_MODELS", "1") == "1"
+EXPORT_PARITY_TOLERANCE = float(os.environ.get("EXPORT_PARITY_TOLERANCE", "1e-4"))  # max abs difference with the eager model
+
+# Incremental training (fine-tune the previous model when new days are added)
+INCREMENTAL_TRAINING = os.environ.get("INCREMENTAL_TRAINING", "1") == "1"
+FINE_TUNE_EPOCHS = int(os.environ.get("FINE_TUNE_EPOCHS", "5"))
+FINE_TUNE_LEARNING_RATE = float(os.environ.get("FINE_TUNE_LEARNING_RATE", "0.01"))
+FULL_RETRAIN_DAYS = int(os.environ.get("FULL_RETRAIN_DAYS", "7"))  # full retrain at least this often
+
+# Training mode: "restaurant" (one model per restaurant) or "global" (one model shared by the fleet)
+TRAINING_MODE = os.environ.get("TRAINING_MODE", "restaurant")
+# Restaurants used to train the global model, e.g. "1,2,3" (default: all)
+GLOBAL_RESTAURANT_IDS = [int(i) for i in os.environ["GLOBAL_RESTAURANT_IDS"].split(",")] if os.environ.get("GLOBAL_RESTAURANT_IDS") else None
+
+# Geocoding cache (address -> coordinates, shared by every process)
+GEOCODE_CACHE_PATH = os.environ.get("GEOCODE_CACHE_PATH", os.path.join(BASE_DIR, "cache", "geocode.sqlite"))
+GEOCODE_CACHE_TTL_DAYS = float(os.environ.get("GEOCODE_CACHE_TTL_DAYS", "180"))
+GEOCODE_NEGATIVE_TTL_HOURS = float(os.environ.get("GEOCODE_NEGATIVE_TTL_HOURS", "24"))  # unknown addresses retried after
+
+# External data sources (data_providers.py): on-disk HTTP cache and per-source TTLs
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", os.path.join(BASE_DIR, "cache", "http"))
+OFFLINE_MODE = os.environ.get("OFFLINE_MODE", "0") == "1"  # never touch the network, cache only
+HOLIDAYS_CROSS_CHECK = os.environ.get("HOLIDAYS_CROSS_CHECK", "0") == "1"  # compare the computed holidays with nager.at
+HOLIDAYS_TTL_HOURS = float(os.environ.get("HOLIDAYS_TTL_HOURS", "720"))  # current/future years (past ones never expire)
+SCHOOL_VACATIONS_TTL_HOURS = float(os.environ.get("SCHOOL_VACATIONS_TTL_HOURS", "24"))  # ranges not yet over
+ARCHIVE_WEATHER_TTL_HOURS = float(os.environ.get("ARCHIVE_WEATHER_TTL_HOURS", "24"))  # ranges still being consolidated
+WEATHER_FORECAST_TTL_HOURS = float(os.environ.get("WEATHER_FORECAST_TTL_HOURS", "3"))  # forecast issue cadence (UTC slots)
+FORECAST_CACHE_DIR = os.environ.get("FORECAST_CACHE_DIR", os.path.join(BASE_DIR, "cache", "forecast"))
+FORECAST_GRID_DEGREES = float(os.environ.get("FORECAST_GRID_DEGREES", "0.1"))  # restaurants of the same cell share one forecast
+
+# Gemini calls: dates split in chunks queried concurrently
+GEMINI_CHUNK_DAYS = int(os.environ.get("GEMINI_CHUNK_DAYS", "4"))
+GEMINI_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_SECONDS", "60"))  # deadline of each attempt
+GEMINI_HEDGE_AFTER_SECONDS = float(os.environ.get("GEMINI_HEDGE_AFTER_SECONDS", "25"))  # duplicate slow/failed chunks (0: never)
+
+# Gemini event cache (events found for an address and a date)
+EVENT_CACHE_PATH = os.environ.get("EVENT_CACHE_PATH", os.path.join(BASE_DIR, "cache", "events.sqlite"))
+EVENT_CACHE_TTL_HOURS = float(os.environ.get("EVENT_CACHE_TTL_HOURS", "36"))  # above the daily run cadence
+EVENT_CACHE_NEAR_DAYS = int(os.environ.get("EVENT_CACHE_NEAR_DAYS", "3"))  # dates closer than this...
+EVENT_CACHE_NEAR_TTL_HOURS = float(os.environ.get("EVENT_CACHE_NEAR_TTL_HOURS", "6"))  # ...are refreshed more often
+
+# Execution backend (worker processes running training + prediction)
+PREDICTION_WORKERS = int(os.environ.get("PREDICTION_WORKERS", str(os.cpu_count() or 1)))
+
+# Admission control (/ws/predict): pipelines running at once, bounded wait queue beyond
+MAX_CONCURRENT_PIPELINES = int(os.environ.get("MAX_CONCURRENT_PIPELINES", str(PREDICTION_WORKERS)))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", str(2 * MAX_CONCURRENT_PIPELINES)))
+ADMISSION_DEFAULT_RUN_SECONDS = float(os.environ.get("ADMISSION_DEFAULT_RUN_SECONDS", "120"))  # start estimates until runs are measured
+
+# Local Parquet copy of the restaurant histories, refreshed incrementally
+HISTORY_CACHE = os.environ.get("HISTORY_CACHE", "1") == "1"
+HISTORY_CACHE_DIR = os.environ.get("HISTORY_CACHE_DIR", os.path.join(BASE_DIR, "cache", "history"))
+
+# Prediction cache (final forecasts served without re-running the pipeline)
+PREDICTION_CACHE_DIR = os.environ.get("PREDICTION_CACHE_DIR", os.path.join(BASE_DIR, "cache", "predictions"))
+PREDICTION_CACHE_TTL_HOURS = float(os.environ.get("PREDICTION_CACHE_TTL_HOURS", "6"))  # stale after, refreshed in background
+
+# Nightly precompute (scheduler.py)
+PRECOMPUTE_WINDOW_START = os.environ.get("PRECOMPUTE_WINDOW_START", "01:00")  # HH:MM, local time
+PRECOMPUTE_WINDOW_END = os.environ.get("PRECOMPUTE_WINDOW_END", "05:00")
+PRECOMPUTE_CONCURRENCY = int(os.environ.get("PRECOMPUTE_CONCURRENCY", str(PREDICTION_WORKERS)))
+PRECOMPUTE_RETRIES = int(os.environ.get("PRECOMPUTE_RETRIES", "2"))
+
 # # Context
 # VILLE_CIBLE = "Chalon-sur-Saône"
 # ADRESSE_CLIENT = "Rue aux Fèvres, 71100 Chalon-sur-Saône"
@@ -1,5 +1,4 @@
-import math
-from math import exp
+import numpy as np
 
 # --- CONSTANTS ---
 
@@ -29,59 +28,96 @@ WMO_DESC = {
     95: "Orage", 96: "Orage avec grêle légère", 99: "Orage avec grêle forte"
 }
 
+# Piecewise distance decay per urban context:
+# (distance thresholds, multipliers below each threshold, tail factor, tail origin, tail scale)
+# Beyond the last threshold: tail factor * exp(-(distance - origin) / scale)
+DISTANCE_DECAY = {
+    "DENSE": ((100, 300, 700), (1.5, 1.0, 0.4), 0.1, 700, 300),
+    "MOYEN": ((200, 500, 1000), (1.3, 1.0, 0.5), 0.15, 1000, 400),
+    "PERIURBAIN": ((300, 800, 2000), (1.2, 1.0, 0.6), 0.2, 2000, 800),  # also RURAL / unknown
+}
+
+# Base impact per event category (CONCERT and BUSINESS depend on the moment, see impact_base_array)
+CATEGORY_IMPACT = {"SPORT": 0.20, "CULTURE": 0.15, "FETE": 0.60, "SPECIAL": 0.60}
+DEFAULT_IMPACT = 0.10
+
+# Weather codes (WMO) and their effect on outdoor events
+RAIN_STORM_CODES = [51, 53, 55, 61, 63, 65, 71, 73, 75, 80, 81, 82, 95, 96, 99]
+FOG_CODES = [45, 48]
+CLEAR_CODES = [0, 1, 2, 3]
+
+# --- ARRAY API ---
+# Each function takes NumPy arrays / pandas columns (or scalars, broadcast)
+# and scores every event in one vectorized pass.
+
+def _strings(values):
+    return np.asarray(values).astype(str)
+
+def impact_distance_array(impact_base, distance_metres, contexte_urbain):
+    """Impact decay based on distance and urban context."""
+    distance = np.asarray(distance_metres, dtype=float)
+    context = _strings(contexte_urbain)
+
+    # Per-event decay parameters, looked up from the urban context
+    table = np.array([
+        [*thresholds, *multipliers, tail, origin, scale]
+        for thresholds, multipliers, tail, origin, scale in DISTANCE_DECAY.values()
+    ])
+    row = np.select([context == "DENSE", context == "MOYEN"], [0, 1], 2)
+    t1, t2, t3, m1, m2, m3, tail, origin, scale = np.moveaxis(table[row], -1, 0)
+
+    with np.errstate(over="ignore"):
+        decayed = tail * np.exp(-(distance - origin) / scale)
+    factor = np.select([distance < t1, distance < t2, distance < t3], [m1, m2, m3], decayed)
+    return np.asarray(impact_base, dtype=float) * factor
+
+def impact_base_array(categorie_evenement, moment_impact, contexte_urbain, type_resto=None):
+    """Base impact score per event category."""
+    category = _strings(categorie_evenement)
+    moment = _strings(moment_impact)
+    context = _strings(contexte_urbain)
+
+    concert_evening = (category == "CONCERT") & (moment == "soir_pre")
+    conditions = [concert_evening & (context == "DENSE"), concert_evening & (context == "MOYEN")]
+    choices = [0.35, 0.25]
+    for name, impact in CATEGORY_IMPACT.items():
+        conditions.append(category == name)
+        choices.append(impact)
+    conditions += [(category == "BUSINESS") & (moment == "midi"), category == "BUSINESS"]
+    choices += [0.10, 0.05]
+    return np.select(conditions, choices, DEFAULT_IMPACT)
+
+def weather_event_modifier_array(w_code, type_lieu):
+    """Event impact modifier based on weather conditions and venue type."""
+    code = np.asarray(w_code, dtype=float)
+    outdoor = np.char.upper(_strings(type_lieu)) == "EXTERIEUR"
+    return np.select(
+        [outdoor & np.isin(code, RAIN_STORM_CODES), # Rain/Storm reduces outdoor event attendance
+         outdoor & np.isin(code, FOG_CODES),
+         outdoor & np.isin(code, CLEAR_CODES)],     # Nice weather boosts outdoor
+        [0.4, 0.7, 1.2],
+        1.0
+    )
+
+def event_impacts(categories, distances, types_lieu, weather_codes, contexte_urbain, type_resto, moment_impact="soir_pre"):
+    """Final SIP impact of each event: base impact x distance decay x weather modifier."""
+    base = impact_base_array(categories, moment_impact, contexte_urbain, type_resto)
+    return impact_distance_array(base, distances, contexte_urbain) * weather_event_modifier_array(weather_codes, types_lieu)
+
 # --- FUNCTIONS ---
+# Scalar versions, kept for single events
 
 def calcul_impact_distance(impact_base, distance_metres, contexte_urbain):
     """Calculates impact decay based on distance and urban context."""
-    if contexte_urbain == "DENSE": 
-        if distance_metres < 100: return impact_base * 1.5 
-        elif distance_metres < 300: return impact_base * 1.0 
-        elif distance_metres < 700: return impact_base * 0.4
-        else: return impact_base * 0.1 * exp(-(distance_metres - 700) / 300)
-    elif contexte_urbain == "MOYEN": 
-        if distance_metres < 200: return impact_base * 1.3
-        elif distance_metres < 500: return impact_base * 1.0
-        elif distance_metres < 1000: return impact_base * 0.5
-        else: return impact_base * 0.15 * exp(-(distance_metres - 1000) / 400)
-    else: # PERIURBAIN / RURAL
-        if distance_metres < 300: return impact_base * 1.2
-        elif distance_metres < 800: return impact_base * 1.0
-        elif distance_metres < 2000: return impact_base * 0.6
-        else: return impact_base * 0.2 * exp(-(distance_metres - 2000) / 800)
+    return float(impact_distance_array(impact_base, distance_metres, contexte_urbain))
 
 def get_impact_base(categorie_evenement, moment_impact, contexte_urbain, type_resto):
     """Returns the base impact score for a given event category."""
-    # Simplified simulation logic matching original script
-    
-    if categorie_evenement == "CONCERT" and moment_impact == "soir_pre":
-        if contexte_urbain == "DENSE": return 0.35
-        if contexte_urbain == "MOYEN": return 0.25
-
-    if categorie_evenement == "SPORT": return 0.20
-    if categorie_evenement == "CULTURE": return 0.15
-    
-    if categorie_evenement == "FETE" or categorie_evenement == "SPECIAL": 
-        return 0.60
-        
-    if categorie_evenement == "BUSINESS": 
-        return 0.10 if moment_impact == "midi" else 0.05
-    
-    return 0.10 # Default fallback
+    return float(impact_base_array(categorie_evenement, moment_impact, contexte_urbain, type_resto))
 
 def get_weather_event_modifier(w_code, type_lieu):
     """Modifies event impact based on weather conditions and venue type."""
-    if not type_lieu or type_lieu.upper() == "INTERIEUR":
-        return 1.0
-    
-    if type_lieu.upper() == "EXTERIEUR":
-        if w_code in [51, 53, 55, 61, 63, 65, 71, 73, 75, 80, 81, 82, 95, 96, 99]:
-            return 0.4 # Rain/Storm reduces outdoor event attendance
-        elif w_code in [45, 48]:
-            return 0.7 # Fog
-        elif w_code in [0, 1, 2, 3]:
-            return 1.2 # Nice weather boosts outdoor
-            
-    return 1.0
+    return float(weather_event_modifier_array(w_code, type_lieu if type_lieu else ""))
 
 def calculer_facteurs_externes_sip(meteo_code, temp_max, is_weekend):
     """Helper to prepare external factors for Gemini prompt context."""
@@ -0,0 +1,155 @@
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import settings
+from http_cache import cache as http_cache
+
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+DAILY_VARIABLES = "weather_code,temperature_2m_max,temperature_2m_min"
+
+
+class ForecastStore:
+    """
+    Open-Meteo daily forecasts shared by every restaurant of the same grid
+    cell (coordinates rounded to FORECAST_GRID_DEGREES). Entries are keyed by
+    cell and issue slot: a new slot starts every WEATHER_FORECAST_TTL_HOURS
+    (UTC), following the provider's update cadence, and older entries are
+    only used when the provider cannot be reached. Concurrent requests for
+    the same cell in a process share one fetch, and warm() fetches many
+    cells in a few multi-location requests.
+    """
+    def __init__(self, directory=settings.FORECAST_CACHE_DIR,
+                 grid_degrees=settings.FORECAST_GRID_DEGREES,
+                 update_hours=settings.WEATHER_FORECAST_TTL_HOURS,
+                 offline=settings.OFFLINE_MODE):
+        self.directory = directory
+        self.grid_degrees = grid_degrees
+        self.update_seconds = update_hours * 3600
+        self.offline = offline
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def cell(self, lat, lon):
+        """Center of the grid cell containing (lat, lon): the coordinates actually fetched."""
+        step = self.grid_degrees
+        return round(round(lat / step) * step, 4), round(round(lon / step) * step, 4)
+
+    def issue(self, now=None):
+        """Current issue slot, e.g. '2026020106'."""
+        now = time.time() if now is None else now
+        slot_start = now - now % self.update_seconds
+        return datetime.fromtimestamp(slot_start, tz=timezone.utc).strftime("%Y%m%d%H")
+
+    def _path(self, cell, issue):
+        return os.path.join(self.directory, f"{cell[0]}_{cell[1]}_{issue}.json")
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[WARNING] Unreadable forecast entry {path}: {e}")
+            return None
+
+    def _write(self, cell, issue, daily):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(cell, issue)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(daily, f)
+        os.replace(tmp_path, path)
+
+        # Previous issues of the cell are no longer needed as fallback
+        for old_path in glob.glob(self._path(cell, "*")):
+            if old_path != path and not old_path.endswith(".tmp"):
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def _latest(self, cell):
+        """Most recent stored forecast of the cell, whatever its issue (None if none)."""
+        paths = sorted(p for p in glob.glob(self._path(cell, "*")) if not p.endswith(".tmp"))
+        return self._read(paths[-1]) if paths else None
+
+    def _fetch(self, cells, timeout=15):
+        """{cell: daily} for the given cells, in one multi-location request."""
+        params = {
+            "latitude": ",".join(str(lat) for lat, _ in cells),
+            "longitude": ",".join(str(lon) for _, lon in cells),
+            "timezone": "auto",
+            "daily": DAILY_VARIABLES,
+            "forecast_days": 16
+        }
+        response = http_cache.session.get(FORECAST_URL, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        # One location: a single object; several: a list in request order
+        results = data if isinstance(data, list) else [data]
+        return {cell: result.get("daily", {}) for cell, result in zip(cells, results)}
+
+    def get(self, lat, lon, timeout=15):
+        """Daily forecast (Open-Meteo 'daily' dict) at (lat, lon), or None if unavailable."""
+        cell = self.cell(lat, lon)
+        issue = self.issue()
+
+        daily = self._read(self._path(cell, issue))
+        if daily is not None:
+            return daily
+        if self.offline:
+            return self._latest(cell)
+
+        key = (cell, issue)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            # Another thread is fetching this cell already
+            return future.result()
+
+        try:
+            daily = self._fetch([cell], timeout=timeout)[cell]
+            self._write(cell, issue, daily)
+        except Exception as e:
+            daily = self._latest(cell)
+            print(f"[WARNING] Weather forecast unavailable ({e}){', using the previous issue' if daily else ''}.")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_result(daily)
+        return daily
+
+    def warm(self, coordinates, chunk_size=50, timeout=30):
+        """
+        Fetches the current issue of every cell covering coordinates
+        [(lat, lon)] that is not stored yet, chunk_size cells per request.
+        Returns the number of cells fetched.
+        """
+        if self.offline:
+            return 0
+        issue = self.issue()
+        cells = sorted({self.cell(lat, lon) for lat, lon in coordinates})
+        missing = [c for c in cells if not os.path.exists(self._path(c, issue))]
+
+        fetched = 0
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i:i + chunk_size]
+            try:
+                for cell, daily in self._fetch(chunk, timeout=timeout).items():
+                    self._write(cell, issue, daily)
+                    fetched += 1
+            except Exception as e:
+                print(f"[WARNING] Weather forecast warm-up failed for {len(chunk)} cells: {e}")
+        return fetched
+
+# Singleton
+store = ForecastStore()
@@ -0,0 +1,26 @@
+<?php
+
+declare(strict_types=1);
+
+namespace DoctrineMigrations;
+
+use Doctrine\DBAL\Schema\Schema;
+use Doctrine\Migrations\AbstractMigration;
+
+final class Version20261018090000 extends AbstractMigration
+{
+    public function getDescription(): string
+    {
+        return 'Composite (restaurant_id, date_historique) index for the history reads of the AI service';
+    }
+
+    public function up(Schema $schema): void
+    {
+        $this->addSql('CREATE INDEX IF NOT EXISTS idx_historique_restaurant_date ON historique_affluence (restaurant_id, date_historique)');
+    }
+
+    public function down(Schema $schema): void
+    {
+        $this->addSql('DROP INDEX IF EXISTS idx_historique_restaurant_date');
+    }
+}
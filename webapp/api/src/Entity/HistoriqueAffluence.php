@@ -6,6 +6,7 @@ use App\Repository\HistoriqueAffluenceRepository;
 use Doctrine\ORM\Mapping as ORM;
 
 #[ORM\Entity(repositoryClass: HistoriqueAffluenceRepository::class)]
+#[ORM\Index(name: 'idx_historique_restaurant_date', columns: ['restaurant_id', 'date_historique'])]
 class HistoriqueAffluence
 {
     #[ORM\Id]
@@ -297,6 +297,13 @@ ALTER TABLE ONLY public."user"
 CREATE INDEX idx_1b004f79b1e7706e ON public.historique_affluence USING btree (restaurant_id);
 
 
+--
+-- Name: idx_historique_restaurant_date; Type: INDEX; Schema: public; Owner: admin
+--
+
+CREATE INDEX idx_historique_restaurant_date ON public.historique_affluence USING btree (restaurant_id, date_historique);
+
+
 --
 -- Name: idx_3bae0aa7b1e7706e; Type: INDEX; Schema: public; Owner: admin
 --